@@ -0,0 +1,184 @@
+"""
+Browser Pool
+============
+מאגר דפדפנים "חמים" לשימוש חוזר בין הורדות
+כל הורדה מקבלת context נקי (incognito) ומחזירה אותו בסיום
+"""
+
+import os
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+# Browserless.io - שירות דפדפן מרוחק חינמי
+BROWSERLESS_URL = os.getenv('BROWSERLESS_URL', 'wss://chrome.browserless.io')
+BROWSERLESS_TOKEN = os.getenv('BROWSERLESS_TOKEN', '')
+
+# הגדרות המאגר
+BROWSER_POOL_SIZE = int(os.getenv('BROWSER_POOL_SIZE', '1'))
+BROWSER_MAX_AGE = int(os.getenv('BROWSER_MAX_AGE', '3600'))
+BROWSER_MAX_USES = int(os.getenv('BROWSER_MAX_USES', '50'))
+BROWSER_HEALTH_TIMEOUT = float(os.getenv('BROWSER_HEALTH_TIMEOUT', '5'))
+# הפעלת דפדפן מראש (בעלייה ואחרי מחזור). כבוי כברירת מחדל - הדפדפן הוא רק גיבוי
+# להתחברות ב-HTTP, ואין טעם להחזיק Chromium (או session ב-Browserless) פתוח כל הזמן
+BROWSER_WARM_UP = os.getenv('BROWSER_WARM_UP', '0') == '1'
+
+
+class _PooledBrowser:
+    """דפדפן במאגר עם זמן יצירה ומספר שימושים"""
+
+    def __init__(self, browser):
+        self.browser = browser
+        self.created_at = time.monotonic()
+        self.uses = 0
+
+    def expired(self) -> bool:
+        """האם הדפדפן צריך מחזור (גיל או מספר שימושים)"""
+        return (time.monotonic() - self.created_at > BROWSER_MAX_AGE
+                or self.uses >= BROWSER_MAX_USES)
+
+
+class BrowserLease:
+    """השאלה של context נקי מהמאגר"""
+
+    def __init__(self, entry: _PooledBrowser, context, page):
+        self.entry = entry
+        self.context = context
+        self.page = page
+        # אפשר לסמן False כדי שהדפדפן לא יחזור למאגר
+        self.healthy = True
+
+
+class BrowserPool:
+    def __init__(self, size: int = BROWSER_POOL_SIZE):
+        self.size = max(size, 1)
+        self._idle = []
+        self._semaphore = None
+
+    def _get_semaphore(self) -> asyncio.Semaphore:
+        if self._semaphore is None:
+            self._semaphore = asyncio.Semaphore(self.size)
+        return self._semaphore
+
+    async def _launch(self) -> _PooledBrowser:
+        """הפעלת דפדפן - מקומי או מרוחק"""
+        import pyppeteer
+
+        started = time.monotonic()
+
+        # אם יש טוקן של Browserless - השתמש בדפדפן מרוחק
+        if BROWSERLESS_TOKEN:
+            browserless_ws = f"{BROWSERLESS_URL}?token={BROWSERLESS_TOKEN}"
+            logger.info(f"Connecting to remote browser (Browserless.io)...")
+            logger.info(f"WebSocket URL: {BROWSERLESS_URL}?token=***")
+            try:
+                browser = await pyppeteer.connect(browserWSEndpoint=browserless_ws)
+                logger.info("Connected to Browserless.io successfully!")
+            except Exception as e:
+                logger.error(f"Failed to connect to Browserless: {e}")
+                raise Exception(f"Browserless connection failed: {e}")
+        else:
+            # דפדפן מקומי
+            logger.info("No BROWSERLESS_TOKEN found, starting local browser...")
+            browser = await pyppeteer.launch(
+                headless=True,
+                args=['--no-sandbox', '--disable-setuid-sandbox', '--disable-dev-shm-usage']
+            )
+
+        logger.info(f"Browser launched in {time.monotonic() - started:.1f}s")
+        return _PooledBrowser(browser)
+
+    async def _is_healthy(self, entry: _PooledBrowser) -> bool:
+        """בדיקה שהדפדפן עדיין מגיב"""
+        try:
+            await asyncio.wait_for(entry.browser.version(), BROWSER_HEALTH_TIMEOUT)
+            return True
+        except Exception as e:
+            logger.warning(f"Browser health check failed: {e}")
+            return False
+
+    async def _retire(self, entry: _PooledBrowser, reason: str):
+        """סגירת דפדפן והוצאתו מהמאגר"""
+        logger.info(f"Recycling browser ({reason}, uses={entry.uses})")
+        try:
+            await entry.browser.close()
+        except Exception as e:
+            logger.debug(f"Error closing retired browser: {e}")
+
+    async def acquire(self) -> BrowserLease:
+        """השאלת context נקי עם דף חדש"""
+        await self._get_semaphore().acquire()
+
+        entry = None
+        try:
+            while self._idle:
+                candidate = self._idle.pop()
+                if candidate.expired():
+                    await self._retire(candidate, 'max age/uses reached')
+                elif not await self._is_healthy(candidate):
+                    await self._retire(candidate, 'failed health check')
+                else:
+                    entry = candidate
+                    break
+
+            if entry is None:
+                entry = await self._launch()
+
+            entry.uses += 1
+            context = await entry.browser.createIncognitoBrowserContext()
+            page = await context.newPage()
+
+            # הגדרת timeout
+            page.setDefaultNavigationTimeout(60000)
+
+            return BrowserLease(entry, context, page)
+
+        except Exception:
+            if entry is not None:
+                await self._retire(entry, 'failed to open context')
+            self._semaphore.release()
+            raise
+
+    async def release(self, lease: BrowserLease):
+        """החזרת ה-context למאגר - ה-context נסגר וכל המצב שלו נמחק"""
+        try:
+            await lease.context.close()
+            if lease.healthy and not lease.entry.expired():
+                self._idle.append(lease.entry)
+            else:
+                await self._retire(lease.entry, 'unhealthy or expired after use')
+                # דפדפן חלופי ברקע כדי שההורדה הבאה לא תחכה (רק אם warm-up פעיל)
+                if BROWSER_WARM_UP:
+                    asyncio.ensure_future(self.warm_up())
+        except Exception as e:
+            logger.error(f"Error releasing browser context: {e}")
+            await self._retire(lease.entry, 'context close failed')
+        finally:
+            self._semaphore.release()
+
+    async def warm_up(self):
+        """הפעלת דפדפן מראש כדי שההורדה הראשונה לא תשלם על זמן ההפעלה"""
+        try:
+            if not self._idle and not self._get_semaphore().locked():
+                self._idle.append(await self._launch())
+        except Exception as e:
+            logger.error(f"Browser warm-up failed: {e}")
+
+    async def close(self):
+        """סגירת כל הדפדפנים במאגר"""
+        while self._idle:
+            await self._retire(self._idle.pop(), 'pool closed')
+
+
+# מאגר יחיד לכל התהליך
+_browser_pool = None
+
+
+def get_browser_pool() -> BrowserPool:
+    """החזרת מאגר הדפדפנים המשותף"""
+    global _browser_pool
+    if _browser_pool is None:
+        _browser_pool = BrowserPool()
+    return _browser_pool
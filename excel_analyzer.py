@@ -5,34 +5,558 @@ Excel Analyzer
 """
 
 import os
+import io
+import asyncio
 import logging
+import atexit
+import threading
+import importlib.util
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+import numpy as np
 import pandas as pd
+from collections.abc import Mapping
 from datetime import datetime
-from typing import Dict, List, Any
+from typing import Dict, List, Any, Union, BinaryIO, Iterator
+
+import sheet_cache
+from schema_index import SchemaIndex, sheet_roles, find_column
 
 logger = logging.getLogger(__name__)
 
+# מנוע הפענוח: auto / openpyxl / calamine
+EXCEL_ENGINE = os.getenv('EXCEL_ENGINE', 'auto')
+# ב-auto: מעל הגודל הזה (bytes) משתמשים ב-calamine אם הוא מותקן
+CALAMINE_MIN_SIZE = int(os.getenv('EXCEL_CALAMINE_MIN_SIZE', str(256 * 1024)))
+CALAMINE_AVAILABLE = importlib.util.find_spec('python_calamine') is not None
+
+
+def source_size(source) -> int:
+    """גודל הקובץ ב-bytes (נתיב או אובייקט קובץ)"""
+    if isinstance(source, str):
+        return os.path.getsize(source)
+    if hasattr(source, 'getbuffer'):
+        return source.getbuffer().nbytes
+    position = source.tell()
+    size = source.seek(0, io.SEEK_END)
+    source.seek(position)
+    return size
+
+
+def select_engine(source, engine: str = EXCEL_ENGINE) -> str:
+    """
+    בחירת מנוע פענוח
+
+    openpyxl (במצב read-only) הוא ברירת המחדל. calamine (מבוסס Rust)
+    מהיר בהרבה ונבחר אוטומטית לקבצים גדולים כשהוא מותקן.
+    """
+    if engine == 'calamine' and not CALAMINE_AVAILABLE:
+        logger.warning("calamine engine requested but python-calamine is not installed, using openpyxl")
+        return 'openpyxl'
+    if engine in ('openpyxl', 'calamine'):
+        return engine
+
+    if CALAMINE_AVAILABLE and source_size(source) >= CALAMINE_MIN_SIZE:
+        return 'calamine'
+    return 'openpyxl'
+
+
+# מצב streaming: מעל הגודל הזה (bytes) גיליונות נקראים בחלקים ולא נטענים במלואם
+STREAMING_MIN_SIZE = int(os.getenv('EXCEL_STREAMING_MIN_SIZE', str(20 * 1024 * 1024)))
+STREAMING_CHUNK_ROWS = int(os.getenv('EXCEL_STREAMING_CHUNK_ROWS', '5000'))
+
+def _available_cpus() -> int:
+    """הליבות שהתהליך רשאי להשתמש בהן (בקונטיינר - לא כל הליבות של השרת)"""
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+# פענוח גיליונות במקביל בתהליכים נפרדים - מספר תהליכים (ברירת מחדל: הליבות הזמינות)
+PARSE_WORKERS = int(os.getenv('EXCEL_PARSE_WORKERS', str(_available_cpus())))
+# מתחת לגודל הזה (bytes) הפענוח מהיר מהעלות של העברת הנתונים בין תהליכים
+PARALLEL_MIN_SIZE = int(os.getenv('EXCEL_PARALLEL_MIN_SIZE', str(1024 * 1024)))
+
+_parse_pool = None
+_parse_pool_lock = threading.Lock()
+
+
+def _get_parse_pool(sheet_count: int) -> ProcessPoolExecutor:
+    """
+    מאגר התהליכים המשותף לפענוח גיליונות
+
+    התהליכים נוצרים דרך forkserver (או spawn) ולא fork - המאגר נוצר
+    מתהליכון הניתוח, בתהליך שכבר מריץ תהליכונים אחרים.
+    """
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is None:
+            methods = multiprocessing.get_all_start_methods()
+            context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+            _parse_pool = ProcessPoolExecutor(
+                max_workers=max(min(PARSE_WORKERS, sheet_count), 1),
+                mp_context=context
+            )
+        return _parse_pool
+
+
+def _reset_parse_pool():
+    """סגירת המאגר - מאגר חדש ייווצר בשימוש הבא"""
+    global _parse_pool
+    with _parse_pool_lock:
+        if _parse_pool is not None:
+            _parse_pool.shutdown(wait=False, cancel_futures=True)
+            _parse_pool = None
+
+
+atexit.register(_reset_parse_pool)
+
+
+def _parse_sheet(source: Union[str, bytes], sheet_name: str, engine: str) -> pd.DataFrame:
+    """פענוח גיליון בודד - רץ בתהליך נפרד"""
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    return pd.read_excel(source, sheet_name=sheet_name, engine=engine)
+
+
+def _read_all(source) -> bytes:
+    position = source.tell()
+    source.seek(0)
+    data = source.read()
+    source.seek(position)
+    return data
+
+
+def parse_sheets_parallel(source, sheet_names: List[str], engine: str) -> Dict[str, pd.DataFrame]:
+    """
+    פענוח כמה גיליונות במקביל, גיליון לכל תהליך
+
+    Returns:
+        שם גיליון -> DataFrame, רק לגיליונות שפוענחו בהצלחה
+    """
+    if not isinstance(source, str):
+        # תהליך אחר לא יכול לקרוא אובייקט קובץ - מעבירים את התוכן
+        source = source.getvalue() if hasattr(source, 'getvalue') else _read_all(source)
+
+    pool = _get_parse_pool(len(sheet_names))
+    futures = {name: pool.submit(_parse_sheet, source, name, engine) for name in sheet_names}
+
+    frames = {}
+    for name, future in futures.items():
+        try:
+            frames[name] = future.result()
+        except BrokenProcessPool as e:
+            # תהליך מת (למשל חוסר זיכרון) - מאגר חדש בפעם הבאה
+            logger.warning(f"Parse pool broken while parsing {name}: {e}")
+            _reset_parse_pool()
+        except Exception as e:
+            logger.warning(f"Parallel parse of sheet {name} failed: {e}")
+    return frames
+
+
+# ניתוח מחוץ ל-event loop: מספר תהליכונים ומגבלת זמן (שניות)
+ANALYSIS_WORKERS = int(os.getenv('EXCEL_ANALYSIS_WORKERS', '2'))
+ANALYSIS_TIMEOUT = float(os.getenv('EXCEL_ANALYSIS_TIMEOUT', '120'))
+
+_analysis_executor = None
+
+
+class AnalysisCancelled(Exception):
+    """הניתוח בוטל (חרג מהזמן או שהבקשה בוטלה)"""
+
+
+# ערכים ש-pandas מפרש כחסרים בקריאת Excel (כולל שגיאות נוסחה)
+NA_STRINGS = {
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND',
+    '1.#QNAN', '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+    '#NULL!', '#DIV/0!', '#VALUE!', '#REF!', '#NAME?', '#NUM!'
+}
+
+# קטגוריות סטטוס בגיליון מעקב הצטרפויות - כל השורות מסווגות לכולן במעבר אחד
+STATUS_CATEGORIES = {
+    'reject': 'דחי|ריג\'קט|reject',
+    'pending_deposit': 'ממתין.*הפקדה|הפקדה ראשונה',
+}
+
+
+def format_value(value) -> str:
+    """ערך תא כטקסט - זהה בין טעינה מלאה ל-streaming"""
+    if not isinstance(value, str) and pd.isna(value):
+        return 'nan'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def classify_statuses(frame: pd.DataFrame, status_cols: List[int]) -> Dict[str, Dict[int, np.ndarray]]:
+    """
+    סיווג כל השורות לכל קטגוריות הסטטוס במעבר אחד
+
+    כל עמודת סטטוס מומרת ל-categorical פעם אחת, התבניות נבדקות רק מול
+    הערכים הייחודיים, והמסכות נבנות מהקודים.
+
+    Args:
+        status_cols: מיקומי עמודות הסטטוס (מה-SchemaIndex)
+
+    Returns:
+        קטגוריה -> {מיקום עמודת סטטוס -> מסכה בוליאנית}
+    """
+    masks = {category: {} for category in STATUS_CATEGORIES}
+    for col in status_cols:
+        values = frame.iloc[:, col].astype('category')
+        labels = values.cat.categories.astype(str).to_series()
+        codes = values.cat.codes.to_numpy()
+
+        for category, pattern in STATUS_CATEGORIES.items():
+            matched = labels.str.contains(pattern, case=False, na=False).to_numpy()
+            # קוד 1- (ערך חסר) נופל על ה-False שבסוף
+            masks[category][col] = np.append(matched, False)[codes]
+    return masks
+
+
+def _stream_cell(value):
+    """המרת ערך תא מ-openpyxl כמו ש-pandas עושה"""
+    if value is None or (isinstance(value, str) and value in NA_STRINGS):
+        return float('nan')
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def _header_names(values) -> list:
+    """שמות עמודות כמו ב-pandas (Unnamed: N, ושכפולים עם .1 .2)"""
+    names = [f'Unnamed: {i}' if v is None else v for i, v in enumerate(values)]
+    counts = {}
+    for i, col in enumerate(names):
+        cur_count = counts.get(col, 0)
+        while cur_count > 0:
+            counts[col] = cur_count + 1
+            col = f'{col}.{cur_count}'
+            cur_count = counts.get(col, 0)
+        names[i] = col
+        counts[col] = cur_count + 1
+    return names
+
+
+class _AmountStats:
+    """count/sum/min/max של עמודת סכום - מצטבר על פני כל הגיליון"""
+
+    def __init__(self):
+        self.count = 0
+        self.sum = 0.0
+        self.min = None
+        self.max = None
+
+    def add(self, values: pd.Series):
+        numbers = pd.to_numeric(values, errors='coerce')
+        count = int(numbers.count())
+        if not count:
+            return
+        self.count += count
+        self.sum += float(numbers.sum())
+        low, high = float(numbers.min()), float(numbers.max())
+        self.min = low if self.min is None else min(self.min, low)
+        self.max = high if self.max is None else max(self.max, high)
+
+    def merge(self, other: '_AmountStats'):
+        if other.count:
+            self.count += other.count
+            self.sum += other.sum
+            self.min = other.min if self.min is None else min(self.min, other.min)
+            self.max = other.max if self.max is None else max(self.max, other.max)
+
+    def as_dict(self) -> Dict[str, Any]:
+        return {'count': self.count, 'sum': self.sum, 'min': self.min, 'max': self.max}
+
+
+class _RowSampler:
+    """
+    ספירת שורות, סטטיסטיקת סכומים ושמירת השורות הראשונות בלבד
+
+    מקבל DataFrame שלם או חלקים שלו - התוצאה זהה.
+    """
+
+    def __init__(self, limit: int, amount_col: int = None):
+        self.limit = limit
+        self.amount_col = amount_col
+        self.count = 0
+        self.amount = _AmountStats()
+        self._heads = []
+        self._taken = 0
+
+    def add(self, frame: pd.DataFrame):
+        self.count += len(frame)
+        if self.amount_col is not None and len(frame):
+            self.amount.add(frame.iloc[:, self.amount_col])
+        if self._taken < self.limit and len(frame):
+            head = frame.head(self.limit - self._taken)
+            self._heads.append(head)
+            self._taken += len(head)
+
+    @property
+    def head(self) -> pd.DataFrame:
+        if not self._heads:
+            return pd.DataFrame()
+        return self._heads[0] if len(self._heads) == 1 else pd.concat(self._heads)
+
+
+def extract_items(df: pd.DataFrame, fields: Dict[str, tuple]) -> List[Dict[str, str]]:
+    """
+    חילוץ פריטים לפי עמודות (בלי לולאה על שורות)
+
+    Args:
+        fields: שם שדה -> (מיקום העמודה או None, ברירת מחדל אם אין עמודה)
+    """
+    columns = {}
+    for field, (col, default) in fields.items():
+        columns[field] = df.iloc[:, col].map(format_value).tolist() if col is not None else [default] * len(df)
+    return [dict(zip(columns, values)) for values in zip(*columns.values())]
+
+
+class LazySheets(Mapping):
+    """
+    גיליונות הקובץ, נטענים רק בגישה הראשונה
+
+    רשימת השמות ידועה מראש; גיליון שלא נגשים אליו לא מפוענח בכלל.
+    גיליון שנכשל בטעינה מוחזר כ-DataFrame ריק.
+
+    Args:
+        names: שמות כל הגיליונות
+        open_xlsx: פונקציה שמחזירה את ה-ExcelFile - נקראת רק כשצריך לפענח
+    """
+
+    def __init__(self, names: List[str], open_xlsx):
+        self._open_xlsx = open_xlsx
+        self._names = list(names)
+        self._loaded = {}
+
+    def __getitem__(self, sheet_name: str) -> pd.DataFrame:
+        if sheet_name not in self._loaded:
+            if sheet_name not in self._names:
+                raise KeyError(sheet_name)
+            try:
+                self._loaded[sheet_name] = pd.read_excel(self._open_xlsx(), sheet_name=sheet_name)
+                logger.info(f"Loaded sheet {sheet_name}")
+            except Exception as e:
+                logger.warning(f"Could not load sheet {sheet_name}: {e}")
+                self._loaded[sheet_name] = pd.DataFrame()
+        return self._loaded[sheet_name]
+
+    def __iter__(self):
+        return iter(self._names)
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def preload(self, frames: Dict[str, pd.DataFrame]):
+        """הוספת גיליונות שכבר פוענחו (למשל בתהליכים אחרים)"""
+        for sheet_name, frame in frames.items():
+            if sheet_name in self._names:
+                self._loaded[sheet_name] = frame
+
+    @property
+    def loaded(self) -> List[str]:
+        """שמות הגיליונות שכבר פוענחו"""
+        return list(self._loaded)
+
 
 class ExcelAnalyzer:
-    def __init__(self, file_path: str):
-        self.file_path = file_path
+    def __init__(self, source: Union[str, bytes, BinaryIO], engine: str = EXCEL_ENGINE,
+                 streaming: bool = None, parallel: bool = None,
+                 cancel_event: threading.Event = None, sha256: str = None,
+                 use_cache: bool = True):
+        """
+        Args:
+            source: נתיב לקובץ, bytes, או אובייקט קובץ (למשל io.BytesIO מההורדה)
+            engine: מנוע הפענוח - auto, openpyxl או calamine
+            streaming: קריאת הגיליונות בחלקים בזיכרון חסום. None - אוטומטי לפי גודל
+            parallel: פענוח הגיליונות הרלוונטיים במקביל בתהליכים. None - אוטומטי
+            cancel_event: כשהוא מסומן הניתוח נעצר בנקודת הבדיקה הבאה
+            sha256: ה-SHA-256 של הקובץ אם כבר ידוע (מההורדה) - מפתח מטמון הגיליונות
+            use_cache: False - פענוח מחדש גם אם הגיליונות במטמון (התוצאה נשמרת מחדש)
+        """
+        self.cancel_event = cancel_event
+        self.sha256 = sha256
+        self.use_cache = use_cache
+        if isinstance(source, (bytes, bytearray)):
+            source = io.BytesIO(source)
+        self.source = source
+        self.file_path = source if isinstance(source, str) else None
+        if streaming is None:
+            streaming = source_size(source) >= STREAMING_MIN_SIZE
+        self.streaming = streaming
+        # streaming עובר דרך openpyxl במצב read-only
+        self.engine = 'openpyxl' if streaming else select_engine(source, engine)
+        if parallel is None:
+            parallel = PARSE_WORKERS > 1 and source_size(source) >= PARALLEL_MIN_SIZE
+        # ב-streaming אין פענוח מלא של גיליונות
+        self.parallel = parallel and not streaming
         self.sheets = {}
+        self.needed_sheets = []
+        self._status_samples = {}
+        self._schema = None
+        self._xlsx = None
+        self.from_cache = False
         self._load_file()
     
+    def _open_xlsx(self) -> pd.ExcelFile:
+        """פתיחת הקובץ עצמו - רק כשבאמת צריך לפענח"""
+        if self._xlsx is None:
+            self._xlsx = pd.ExcelFile(self.source, engine=self.engine)
+        return self._xlsx
+
+    def _load_cached(self) -> bool:
+        """טעינת הגיליונות ממטמון לפי SHA-256, בלי לפענח את הקובץ"""
+        # ב-streaming הזיכרון חסום - לא טוענים גיליונות שלמים
+        if self.streaming or not sheet_cache.SHEET_CACHE_ENABLED:
+            return False
+        if self.sha256 is None:
+            self.sha256 = sheet_cache.file_sha256(self.source)
+        if not self.use_cache:
+            return False
+
+        sheet_names, frames = sheet_cache.load(self.sha256)
+        if sheet_names is None:
+            return False
+        self.sheets = LazySheets(sheet_names, self._open_xlsx)
+        self.sheets.preload(frames)
+        self.from_cache = True
+        return True
+
+    def _store_cached(self):
+        """שמירת הגיליונות שפוענחו למטמון"""
+        if self.from_cache or self.sha256 is None or self.streaming:
+            return
+        sheet_cache.save(
+            self.sha256,
+            list(self.sheets),
+            {name: self.sheets[name] for name in self.needed_sheets}
+        )
+
     def _load_file(self):
-        """טעינת הקובץ"""
+        """פתיחת הקובץ - הגיליונות עצמם נטענים רק כשצריך"""
         try:
-            xlsx = pd.ExcelFile(self.file_path)
-            for sheet_name in xlsx.sheet_names:
-                try:
-                    self.sheets[sheet_name] = pd.read_excel(xlsx, sheet_name=sheet_name)
-                except Exception as e:
-                    logger.warning(f"Could not load sheet {sheet_name}: {e}")
-            logger.info(f"Loaded {len(self.sheets)} sheets")
+            if not self._load_cached():
+                self.sheets = LazySheets(self._open_xlsx().sheet_names, self._open_xlsx)
+            self.needed_sheets = [name for name in self.sheets if sheet_roles(name)]
+            logger.info(
+                f"Workbook has {len(self.sheets)} sheets ({self.engine} engine"
+                f"{', streaming' if self.streaming else ''}"
+                f"{', from cache' if self.from_cache else ''}), "
+                f"{len(self.needed_sheets)} needed: {self.needed_sheets}"
+            )
+            if self.parallel and not self.from_cache and len(self.needed_sheets) > 1:
+                # גיליון שנכשל כאן ייטען כרגיל בגישה הראשונה
+                self.sheets.preload(parse_sheets_parallel(self.source, self.needed_sheets, self.engine))
+                logger.info(f"Parsed {len(self.sheets.loaded)} sheets in parallel")
         except Exception as e:
             logger.error(f"Error loading Excel file: {e}")
             raise
-    
+
+    def _stream_rows(self, sheet_name: str) -> tuple:
+        """(שמות העמודות, איטרטור על שאר השורות) - קריאה ישירה מ-openpyxl"""
+        rows = self._open_xlsx().book[sheet_name].iter_rows(values_only=True)
+        header = list(next(rows, None) or [])
+        # עמודות ריקות בסוף הכותרת לא נכללות
+        while header and header[-1] is None:
+            header.pop()
+        return _header_names(header), rows
+
+    def _sheet_columns(self, sheet_name: str) -> list:
+        """שמות עמודות הגיליון - במצב streaming מהשורה הראשונה בלבד"""
+        if not self.streaming:
+            return list(self.sheets[sheet_name].columns)
+        try:
+            return self._stream_rows(sheet_name)[0]
+        except Exception as e:
+            logger.warning(f"Could not read header of sheet {sheet_name}: {e}")
+            return []
+
+    @property
+    def schema(self) -> SchemaIndex:
+        """מבנה הקובץ (תפקידי גיליונות ועמודות), נבנה או נטען מהמטמון פעם אחת"""
+        if self._schema is None:
+            self._schema = SchemaIndex(
+                list(self.sheets),
+                {name: self._sheet_columns(name) for name in self.needed_sheets}
+            )
+        return self._schema
+
+    def _sheets_for(self, role: str) -> List[str]:
+        """שמות הגיליונות שממלאים תפקיד נתון, לפי סדר הקובץ"""
+        return self.schema.sheets_for(role)
+
+    def _column(self, sheet_name: str, role: str) -> int:
+        """מיקום עמודה לפי תפקיד"""
+        return self.schema.column(sheet_name, role)
+
+    def _check_cancelled(self):
+        """עצירה אם הניתוח בוטל"""
+        if self.cancel_event is not None and self.cancel_event.is_set():
+            raise AnalysisCancelled()
+
+    def _iter_frames(self, sheet_name: str):
+        """הגיליון כ-DataFrame אחד, או בחלקים במצב streaming"""
+        self._check_cancelled()
+        if not self.streaming:
+            yield self.sheets[sheet_name]
+            return
+
+        try:
+            columns, rows = self._stream_rows(sheet_name)
+        except Exception as e:
+            logger.warning(f"Could not stream sheet {sheet_name}: {e}")
+            return
+        width = len(columns)
+
+        chunk = []
+        blank_rows = []
+        for row in rows:
+            values = [_stream_cell(v) for v in row[:width]]
+            values.extend([float('nan')] * (width - len(values)))
+
+            # שורות ריקות נשמרות רק אם יש אחריהן נתונים (כמו ב-pandas)
+            if all(isinstance(v, float) and v != v for v in values):
+                blank_rows.append(values)
+                continue
+            chunk.extend(blank_rows)
+            blank_rows = []
+            chunk.append(values)
+
+            if len(chunk) >= STREAMING_CHUNK_ROWS:
+                yield pd.DataFrame(chunk, columns=columns)
+                chunk = []
+                self._check_cancelled()
+
+        if chunk:
+            yield pd.DataFrame(chunk, columns=columns)
+
+    def _sample(self, sheet_name: str, limit: int) -> _RowSampler:
+        """ספירת שורות הגיליון ושמירת השורות הראשונות"""
+        sampler = _RowSampler(limit, self._column(sheet_name, 'amount'))
+        for frame in self._iter_frames(sheet_name):
+            sampler.add(frame)
+        return sampler
+
+    def _sample_by_status(self, sheet_name: str, category: str) -> Dict[Any, _RowSampler]:
+        """
+        שורות בקטגוריית סטטוס - לכל עמודת סטטוס בנפרד
+
+        הגיליון מסווג פעם אחת לכל הקטגוריות; קריאות נוספות משתמשות בתוצאה.
+        """
+        if sheet_name not in self._status_samples:
+            samples = {c: {} for c in STATUS_CATEGORIES}
+            status_cols = self.schema.status_columns(sheet_name)
+            amount_col = self._column(sheet_name, 'amount')
+            for frame in self._iter_frames(sheet_name):
+                for c, column_masks in classify_statuses(frame, status_cols).items():
+                    for col, mask in column_masks.items():
+                        samples[c].setdefault(col, _RowSampler(10, amount_col)).add(frame[mask])
+            self._status_samples[sheet_name] = samples
+        return self._status_samples[sheet_name][category]
+
     def analyze(self) -> str:
         """ניתוח מלא של הדוח והחזרת סיכום"""
         report_lines = []
@@ -90,162 +614,219 @@ class ExcelAnalyzer:
         report_lines.append("─────────────────────────────────")
         report_lines.append(f"📅 עודכן: {datetime.now().strftime('%d/%m/%Y %H:%M')}")
         
+        self._store_cached()
+        
         return "\n".join(report_lines)
     
     def _analyze_rejects(self) -> Dict[str, Any]:
         """ניתוח ריג'קטים"""
-        result = {'count': 0, 'items': []}
+        result = {'count': 0, 'items': [], 'amount': _AmountStats().as_dict()}
         
         # חיפוש גיליון ריג'קטים
-        reject_sheets = [
-            'ריג\'קטים בהצטרפות',
-            'ריגקטים בהצטרפות',
-            'rejects'
-        ]
-        
-        df = None
-        for sheet_name in self.sheets:
-            if any(reject in sheet_name for reject in reject_sheets):
-                df = self.sheets[sheet_name]
-                break
+        sample = None
+        source_sheet = None
+        for sheet_name in self._sheets_for('rejects'):
+            sample = self._sample(sheet_name, 10)
+            source_sheet = sheet_name
+            break
         
         # גם בודק בגיליון מעקב הצטרפויות
-        if df is None or df.empty:
-            for sheet_name in self.sheets:
-                if 'מעקב הצטרפויות' in sheet_name:
-                    temp_df = self.sheets[sheet_name]
-                    # מחפש שורות עם סטטוס ריג'קט/דחייה
-                    status_cols = [col for col in temp_df.columns if 'סטטוס' in str(col)]
-                    for col in status_cols:
-                        mask = temp_df[col].astype(str).str.contains('דחי|ריג\'קט|reject', case=False, na=False)
-                        if mask.any():
-                            df = temp_df[mask]
-                            break
-        
-        if df is not None and not df.empty:
-            result['count'] = len(df)
-            
-            # חיפוש עמודות רלוונטיות
-            name_col = self._find_column(df, ['שם', 'עמית', 'name'])
-            reason_col = self._find_column(df, ['סיבה', 'תיאור', 'reason', 'ריג\'קט'])
+        if sample is None or sample.count == 0:
+            for sheet_name in self._sheets_for('join_tracking'):
+                # מחפש שורות עם סטטוס ריג'קט/דחייה
+                for status_sample in self._sample_by_status(sheet_name, 'reject').values():
+                    if status_sample.count:
+                        sample = status_sample
+                        source_sheet = sheet_name
+                        break
+        
+        if sample is not None and sample.count:
+            result['count'] = sample.count
+            result['amount'] = sample.amount.as_dict()
+            result['items'] = self._extract_items(source_sheet, sample.head, {
+                'name': ('reject_name', 'לא ידוע'),
+                'reason': ('reason', 'לא צוין'),
+            })
             
-            for _, row in df.head(10).iterrows():
-                name = str(row[name_col]) if name_col else 'לא ידוע'
-                reason = str(row[reason_col]) if reason_col else 'לא צוין'
-                
-                # קיצור הסיבה
-                if len(reason) > 30:
-                    reason = reason[:30] + '...'
-                
-                result['items'].append({
-                    'name': name,
-                    'reason': reason
-                })
+            # קיצור הסיבה
+            for item in result['items']:
+                if len(item['reason']) > 30:
+                    item['reason'] = item['reason'][:30] + '...'
         
         return result
     
     def _analyze_pending_deposits(self) -> Dict[str, Any]:
         """ניתוח ממתינים להפקדה ראשונה"""
         result = {'count': 0, 'items': []}
+        amount = _AmountStats()
         
-        for sheet_name in self.sheets:
-            if 'מעקב הצטרפויות' in sheet_name:
-                df = self.sheets[sheet_name]
-                
-                # מחפש שורות עם סטטוס "ממתין להפקדה"
-                status_cols = [col for col in df.columns if 'סטטוס' in str(col)]
-                for col in status_cols:
-                    mask = df[col].astype(str).str.contains('ממתין.*הפקדה|הפקדה ראשונה', case=False, na=False)
-                    if mask.any():
-                        filtered_df = df[mask]
-                        result['count'] += len(filtered_df)
-                        
-                        name_col = self._find_column(filtered_df, ['שם', 'עמית'])
-                        product_col = self._find_column(filtered_df, ['מוצר', 'קופה', 'product'])
-                        
-                        for _, row in filtered_df.head(10).iterrows():
-                            result['items'].append({
-                                'name': str(row[name_col]) if name_col else 'לא ידוע',
-                                'product': str(row[product_col]) if product_col else ''
-                            })
+        for sheet_name in self._sheets_for('join_tracking'):
+            # מחפש שורות עם סטטוס "ממתין להפקדה"
+            for sample in self._sample_by_status(sheet_name, 'pending_deposit').values():
+                if sample.count:
+                    result['count'] += sample.count
+                    amount.merge(sample.amount)
+                    result['items'].extend(self._extract_items(sheet_name, sample.head, {
+                        'name': ('name', 'לא ידוע'),
+                        'product': ('product', ''),
+                    }))
         
+        result['amount'] = amount.as_dict()
+        return result
+    
+    def _analyze_sheet_role(self, role: str, fields: Dict[str, tuple]) -> Dict[str, Any]:
+        """ניתוח גיליונות שכל השורות בהם שייכות לקטגוריה (ניוד, הצטרפויות)"""
+        result = {'count': 0, 'items': []}
+        amount = _AmountStats()
+        
+        for sheet_name in self._sheets_for(role):
+            sample = self._sample(sheet_name, 5)
+            if sample.count:
+                result['count'] += sample.count
+                amount.merge(sample.amount)
+                result['items'].extend(self._extract_items(sheet_name, sample.head, fields))
+        
+        result['amount'] = amount.as_dict()
         return result
     
     def _analyze_transfers_in(self) -> Dict[str, Any]:
         """ניתוח צפי ניוד נכנס"""
-        result = {'count': 0, 'items': [], 'total_amount': 0}
-        
-        transfer_sheets = ['העברה פנימה', 'ניוד נכנס', 'transfer in']
-        
-        for sheet_name in self.sheets:
-            if any(t in sheet_name.lower() for t in transfer_sheets):
-                df = self.sheets[sheet_name]
-                if not df.empty:
-                    result['count'] = len(df)
-                    
-                    name_col = self._find_column(df, ['שם', 'עמית'])
-                    amount_col = self._find_column(df, ['סכום', 'יתרה', 'amount'])
-                    
-                    for _, row in df.head(5).iterrows():
-                        result['items'].append({
-                            'name': str(row[name_col]) if name_col else 'לא ידוע'
-                        })
-                        
-                        if amount_col:
-                            try:
-                                result['total_amount'] += float(row[amount_col])
-                            except:
-                                pass
-        
+        result = self._analyze_sheet_role('transfers_in', {
+            'name': ('name', 'לא ידוע'),
+        })
+        # סה"כ על כל שורות הגיליון
+        result['total_amount'] = result['amount']['sum']
         return result
     
     def _analyze_transfers_out(self) -> Dict[str, Any]:
         """ניתוח ניוד יוצא"""
-        result = {'count': 0, 'items': []}
-        
-        transfer_sheets = ['העברה החוצה', 'ניוד יוצא', 'transfer out']
-        
-        for sheet_name in self.sheets:
-            if any(t in sheet_name.lower() for t in transfer_sheets):
-                df = self.sheets[sheet_name]
-                if not df.empty:
-                    result['count'] = len(df)
-                    
-                    name_col = self._find_column(df, ['שם', 'עמית'])
-                    
-                    for _, row in df.head(5).iterrows():
-                        result['items'].append({
-                            'name': str(row[name_col]) if name_col else 'לא ידוע'
-                        })
-        
-        return result
+        return self._analyze_sheet_role('transfers_out', {
+            'name': ('name', 'לא ידוע'),
+        })
     
     def _analyze_new_joins(self) -> Dict[str, Any]:
         """ניתוח הצטרפויות חדשות"""
-        result = {'count': 0, 'items': []}
-        
-        for sheet_name in self.sheets:
-            if 'הצטרפויות' in sheet_name and 'מעקב' not in sheet_name:
-                df = self.sheets[sheet_name]
-                if not df.empty:
-                    result['count'] = len(df)
-                    
-                    name_col = self._find_column(df, ['שם', 'עמית'])
-                    product_col = self._find_column(df, ['מוצר', 'קופה', 'product'])
-                    
-                    for _, row in df.head(5).iterrows():
-                        result['items'].append({
-                            'name': str(row[name_col]) if name_col else 'לא ידוע',
-                            'product': str(row[product_col]) if product_col else ''
-                        })
-        
-        return result
+        return self._analyze_sheet_role('new_joins', {
+            'name': ('name', 'לא ידוע'),
+            'product': ('product', ''),
+        })
     
+    def _extract_items(self, sheet_name: str, df: pd.DataFrame,
+                       fields: Dict[str, tuple]) -> List[Dict[str, str]]:
+        """חילוץ פריטים - fields: שם שדה -> (תפקיד עמודה, ברירת מחדל)"""
+        return extract_items(df, {
+            field: (self._column(sheet_name, role), default)
+            for field, (role, default) in fields.items()
+        })
+
+    def records(self) -> Iterator[Dict[str, Any]]:
+        """
+        כל השורות של כל הקטגוריות (לא רק הדוגמאות שבסיכום) - לשמירה היסטורית
+
+        generator: במצב streaming השורות נוצרות חלק אחרי חלק, כך שהזיכרון
+        נשאר חסום גם כשכל הדוח נשמר
+
+        Yields:
+            dict עם category, name, product, reason, amount
+        """
+        # ריג'קטים: הגיליון הייעודי, ואם הוא ריק - סטטוס דחייה במעקב הצטרפויות
+        found_rejects = False
+        for sheet_name in self._sheets_for('rejects')[:1]:
+            for frame in self._iter_frames(sheet_name):
+                for row in self._frame_records(sheet_name, frame, 'rejects', 'reject_name'):
+                    found_rejects = True
+                    yield row
+        if not found_rejects:
+            for sheet_name in self._sheets_for('join_tracking'):
+                yield from self._status_records(sheet_name, 'reject', 'rejects', 'reject_name')
+
+        for sheet_name in self._sheets_for('join_tracking'):
+            yield from self._status_records(sheet_name, 'pending_deposit', 'pending_deposits')
+
+        for role in ('transfers_in', 'transfers_out', 'new_joins'):
+            for sheet_name in self._sheets_for(role):
+                for frame in self._iter_frames(sheet_name):
+                    yield from self._frame_records(sheet_name, frame, role)
+
+    def _status_records(self, sheet_name: str, status: str, category: str,
+                        name_role: str = 'name') -> Iterator[Dict[str, Any]]:
+        """שורות שאחת מעמודות הסטטוס שלהן בקטגוריה (כל שורה פעם אחת)"""
+        status_cols = self.schema.status_columns(sheet_name)
+        for frame in self._iter_frames(sheet_name):
+            masks = list(classify_statuses(frame, status_cols)[status].values())
+            if masks:
+                yield from self._frame_records(
+                    sheet_name, frame[np.logical_or.reduce(masks)], category, name_role
+                )
+
+    def _frame_records(self, sheet_name: str, frame: pd.DataFrame, category: str,
+                       name_role: str = 'name') -> List[Dict[str, Any]]:
+        """שורות ה-DataFrame כרשומות - ערך חסר נשמר כ-None"""
+        columns = {}
+        for field, role in (('name', name_role), ('product', 'product'), ('reason', 'reason')):
+            col = self._column(sheet_name, role)
+            columns[field] = (
+                [None if v == 'nan' else v for v in frame.iloc[:, col].map(format_value)]
+                if col is not None else [None] * len(frame)
+            )
+
+        col = self._column(sheet_name, 'amount')
+        if col is not None:
+            amounts = pd.to_numeric(frame.iloc[:, col], errors='coerce')
+            columns['amount'] = [None if pd.isna(v) else float(v) for v in amounts]
+        else:
+            columns['amount'] = [None] * len(frame)
+
+        return [dict(zip(columns, values), category=category) for values in zip(*columns.values())]
+
     def _find_column(self, df: pd.DataFrame, keywords: List[str]) -> str:
         """מציאת עמודה לפי מילות מפתח"""
-        for col in df.columns:
-            col_str = str(col).lower()
-            for keyword in keywords:
-                if keyword.lower() in col_str:
-                    return col
-        return None
+        position = find_column(df.columns, keywords)
+        return df.columns[position] if position is not None else None
+
+
+def _get_analysis_executor() -> ThreadPoolExecutor:
+    """ה-executor הייעודי לניתוח - לא חולק עם שאר הבוט"""
+    global _analysis_executor
+    if _analysis_executor is None:
+        _analysis_executor = ThreadPoolExecutor(
+            max_workers=ANALYSIS_WORKERS, thread_name_prefix='excel-analysis'
+        )
+    return _analysis_executor
+
+
+def _run_analysis(source, cancel_event: threading.Event, sha256: str, use_cache: bool) -> tuple:
+    analyzer = ExcelAnalyzer(source, cancel_event=cancel_event, sha256=sha256, use_cache=use_cache)
+    return analyzer.analyze(), analyzer
+
+
+async def analyze_report(source: Union[str, bytes, BinaryIO],
+                         timeout: float = ANALYSIS_TIMEOUT, sha256: str = None,
+                         return_analyzer: bool = False, use_cache: bool = True):
+    """
+    ניתוח הדוח ב-executor נפרד, כך שה-event loop ממשיך לענות בזמן הפענוח
+
+    Args:
+        sha256: ה-SHA-256 של הקובץ אם ידוע - חוסך חישוב לפני בדיקת המטמון
+        return_analyzer: להחזיר גם את ה-ExcelAnalyzer (למשל לשמירת השורות בהיסטוריה)
+        use_cache: False - לא לטעון גיליונות ממטמון הגיליונות
+
+    Returns:
+        הסיכום, או (סיכום, ExcelAnalyzer) עם return_analyzer
+
+    Raises:
+        asyncio.TimeoutError: אם הניתוח חרג מ-timeout (הניתוח עצמו נעצר)
+    """
+    cancel_event = threading.Event()
+    loop = asyncio.get_running_loop()
+    future = loop.run_in_executor(_get_analysis_executor(), _run_analysis,
+                                  source, cancel_event, sha256, use_cache)
+    try:
+        summary, analyzer = await asyncio.wait_for(future, timeout)
+    except (asyncio.TimeoutError, asyncio.CancelledError):
+        # התהליכון לא נקטע מבחוץ - הוא עוצר בנקודת הבדיקה הבאה
+        cancel_event.set()
+        logger.warning("Report analysis timed out or was cancelled")
+        raise
+
+    return (summary, analyzer) if return_analyzer else summary
@@ -0,0 +1,117 @@
+"""
+Gmail Async Client
+==================
+גישה אסינכרונית ל-Gmail REST API באמצעות aiohttp
+"""
+
+import os
+import asyncio
+import logging
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+GMAIL_API_BASE = 'https://gmail.googleapis.com/gmail/v1/users/me'
+
+# הגבלות זמן וחיבורים
+GMAIL_REQUEST_TIMEOUT = float(os.getenv('GMAIL_REQUEST_TIMEOUT', '20'))
+GMAIL_MAX_CONNECTIONS = int(os.getenv('GMAIL_MAX_CONNECTIONS', '10'))
+
+
+class GmailAPIError(Exception):
+    """שגיאה שהוחזרה מ-Gmail API"""
+
+    def __init__(self, status: int, message: str):
+        super().__init__(f"Gmail API error {status}: {message}")
+        self.status = status
+
+
+class GmailAsyncClient:
+    """
+    לקוח Gmail אסינכרוני עם session משותף (keep-alive)
+
+    Args:
+        token_provider: פונקציה אסינכרונית שמחזירה access token תקף
+        token_refresher: פונקציה אסינכרונית שמרעננת את ה-token אחרי 401
+            (מקבלת את ה-token שנדחה)
+    """
+
+    def __init__(self, token_provider, token_refresher):
+        self._token_provider = token_provider
+        self._token_refresher = token_refresher
+        self._session = None
+
+    def _get_session(self) -> aiohttp.ClientSession:
+        """יצירת ה-session בפעם הראשונה (בתוך ה-event loop)"""
+        if self._session is None or self._session.closed:
+            connector = aiohttp.TCPConnector(
+                limit=GMAIL_MAX_CONNECTIONS,
+                keepalive_timeout=60
+            )
+            self._session = aiohttp.ClientSession(
+                connector=connector,
+                timeout=aiohttp.ClientTimeout(total=GMAIL_REQUEST_TIMEOUT)
+            )
+        return self._session
+
+    async def _request(self, method: str, path: str, params=None) -> dict:
+        """שליחת בקשה ל-API, עם רענון token וניסיון חוזר אחד על 401"""
+        session = self._get_session()
+
+        for attempt in range(2):
+            token = await self._token_provider()
+            headers = {'Authorization': f'Bearer {token}'}
+
+            async with session.request(method, f"{GMAIL_API_BASE}/{path}",
+                                       params=params, headers=headers) as response:
+                if response.status == 401 and attempt == 0:
+                    logger.warning("Gmail API returned 401, refreshing token")
+                    await self._token_refresher(token)
+                    continue
+
+                if response.status != 200:
+                    text = await response.text()
+                    raise GmailAPIError(response.status, text[:500])
+
+                return await response.json()
+
+    async def list_messages(self, query: str, max_results: int = 10) -> list:
+        """רשימת הודעות לפי חיפוש"""
+        data = await self._request('GET', 'messages', params={
+            'q': query,
+            'maxResults': max_results
+        })
+        return data.get('messages', [])
+
+    async def get_message(self, message_id: str, format: str = 'full',
+                          metadata_headers: list = None) -> dict:
+        """קבלת הודעה בודדת"""
+        params = [('format', format)]
+        # ב-format=metadata מחזירים רק את הכותרות המבוקשות
+        for header in metadata_headers or []:
+            params.append(('metadataHeaders', header))
+        return await self._request('GET', f'messages/{message_id}', params=params)
+
+    async def get_messages(self, message_ids: list, format: str = 'full',
+                           metadata_headers: list = None) -> list:
+        """קבלת כמה הודעות במקביל"""
+        return await asyncio.gather(
+            *(self.get_message(mid, format, metadata_headers) for mid in message_ids)
+        )
+
+    async def list_history(self, start_history_id: str,
+                           history_types: tuple = ('messageAdded',)) -> dict:
+        """שינויים בתיבה מאז history ID נתון"""
+        params = [('startHistoryId', start_history_id)]
+        for history_type in history_types:
+            params.append(('historyTypes', history_type))
+        return await self._request('GET', 'history', params=params)
+
+    async def get_profile(self) -> dict:
+        """פרופיל התיבה (כולל ה-historyId הנוכחי)"""
+        return await self._request('GET', 'profile')
+
+    async def close(self):
+        """סגירת ה-session"""
+        if self._session and not self._session.closed:
+            await self._session.close()
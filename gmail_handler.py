@@ -7,32 +7,48 @@ Gmail Handler
 import os
 import re
 import base64
+import asyncio
 import logging
 from datetime import datetime
 from google.oauth2.credentials import Credentials
 from google_auth_oauthlib.flow import InstalledAppFlow
 from google.auth.transport.requests import Request
-from googleapiclient.discovery import build
 import pickle
+from gmail_client import GmailAsyncClient, GmailAPIError
 
 logger = logging.getLogger(__name__)
 
 # Gmail API scopes
 SCOPES = ['https://www.googleapis.com/auth/gmail.readonly']
 
+# קישורי SafeMail של מיטב
+SAFEMAIL_URL_RE = re.compile(r'https?://safemail\.meitav\.co\.il[^\s\'"<>]+', re.IGNORECASE)
+SAFEMAIL_LOGIN_RE = re.compile(r'/Safe-T/login\.aspx', re.IGNORECASE)
+SUBJECT_DATE_RE = re.compile(r'(\d{2}/\d{2}/\d{4})')
+
+# כמה שניות לפני פקיעת ה-token לרענן אותו ברקע
+TOKEN_REFRESH_MARGIN = int(os.getenv('GMAIL_TOKEN_REFRESH_MARGIN', '300'))
+
 
 class GmailHandler:
     def __init__(self):
-        self.service = None
         self.creds = None
+        self.token_path = os.getenv('GMAIL_TOKEN_PATH', 'token.pickle')
+        self._refresh_task = None
+        self._token_lock = None
+        # מצב סנכרון אינקרמנטלי
+        self._last_history_id = None
+        self._latest_meitav_id = None
+        self._latest_meitav_email = None
         self._authenticate()
+        self.api = GmailAsyncClient(self._get_access_token, self._force_refresh)
     
     def _authenticate(self):
         """אימות מול Gmail API"""
         creds = None
         
         # בדיקה אם יש token שמור
-        token_path = os.getenv('GMAIL_TOKEN_PATH', 'token.pickle')
+        token_path = self.token_path
         credentials_path = os.getenv('GMAIL_CREDENTIALS_PATH', 'credentials.json')
         
         if os.path.exists(token_path):
@@ -60,33 +76,147 @@ class GmailHandler:
                 else:
                     raise Exception("No Gmail credentials found. Please set up OAuth2 credentials.")
             
-            # שמירת ה-token
-            with open(token_path, 'wb') as token:
-                pickle.dump(creds, token)
+            self.creds = creds
+            self._save_credentials()
         
         self.creds = creds
-        self.service = build('gmail', 'v1', credentials=creds)
         logger.info("Gmail authenticated successfully")
+
+    def _save_credentials(self):
+        """שמירת ה-token לקובץ"""
+        try:
+            with open(self.token_path, 'wb') as token:
+                pickle.dump(self.creds, token)
+        except Exception as e:
+            logger.warning(f"Could not save Gmail token: {e}")
+
+    def _refresh_credentials(self):
+        """רענון ה-token (חוסם - רץ ב-thread)"""
+        self.creds.refresh(Request())
+        self._save_credentials()
+        logger.info(f"Gmail token refreshed, expires at {self.creds.expiry}")
+
+    def _seconds_until_refresh(self) -> float:
+        """זמן עד הרענון הבא של ה-token"""
+        if not self.creds.expiry:
+            return 0 if not self.creds.valid else 3000
+        remaining = (self.creds.expiry - datetime.utcnow()).total_seconds()
+        return max(remaining - TOKEN_REFRESH_MARGIN, 0)
+
+    def start_token_refresher(self):
+        """הפעלת רענון token ברקע בתוך ה-event loop הנוכחי"""
+        if self._refresh_task is None or self._refresh_task.done():
+            self._refresh_task = asyncio.get_running_loop().create_task(self._token_refresh_loop())
+
+    async def _get_access_token(self) -> str:
+        """access token תקף לבקשות האסינכרוניות"""
+        if not self.creds.valid:
+            await self._force_refresh(self.creds.token)
+        return self.creds.token
+
+    async def _force_refresh(self, failed_token: str = None):
+        """
+        רענון token מיידי בלי לחסום את ה-event loop
+
+        Args:
+            failed_token: ה-token שנכשל. אם בינתיים בקשה אחרת כבר רעננה
+                אותו (בקשות במקביל) - לא מרעננים שוב
+        """
+        if self._token_lock is None:
+            self._token_lock = asyncio.Lock()
+        async with self._token_lock:
+            if failed_token is not None and self.creds.token != failed_token and self.creds.valid:
+                return
+            await asyncio.to_thread(self._refresh_credentials)
+
+    async def _token_refresh_loop(self):
+        """רענון יזום של ה-token לפני שהוא פג"""
+        while True:
+            await asyncio.sleep(self._seconds_until_refresh())
+            try:
+                await self._force_refresh()
+            except Exception as e:
+                logger.error(f"Background Gmail token refresh failed: {e}")
+                await asyncio.sleep(60)
     
-    def get_latest_meitav_email(self) -> dict:
+    async def list_messages(self, query: str, max_results: int = 10) -> list:
+        """רשימת הודעות לפי חיפוש (אסינכרוני)"""
+        return await self.api.list_messages(query, max_results)
+
+    async def get_message(self, message_id: str, format: str = 'full') -> dict:
+        """קבלת הודעה (אסינכרוני)"""
+        return await self.api.get_message(message_id, format)
+
+    async def get_messages_metadata(self, message_ids: list,
+                                    headers: tuple = ('Subject', 'Date')) -> list:
+        """
+        קבלת כותרות בלבד לכמה הודעות במקביל (בלי להוריד את גוף ההודעה)
+
+        Returns:
+            רשימת dict עם id ושמות הכותרות המבוקשות
+        """
+        messages = await self.api.get_messages(message_ids, 'metadata', list(headers))
+
+        results = []
+        for message in messages:
+            item = {'id': message['id']}
+            for h in message.get('payload', {}).get('headers', []):
+                if h['name'] in headers and h['name'] not in item:
+                    item[h['name']] = h['value']
+            results.append(item)
+        return results
+
+    async def get_email_body(self, message_id: str, mime_type: str = 'text/plain') -> str:
+        """קבלת הודעה וחילוץ התוכן שלה (אסינכרוני)"""
+        message = await self.get_message(message_id)
+        return self._get_email_body(message, mime_type)
+
+    async def _mailbox_unchanged(self) -> bool:
+        """בדיקה דרך history.list אם לא הגיעו הודעות חדשות מאז הסנכרון האחרון"""
+        if not self._last_history_id or not self._latest_meitav_email:
+            return False
+
+        try:
+            data = await self.api.list_history(self._last_history_id)
+        except GmailAPIError as e:
+            if e.status == 404:
+                # ה-history ID ישן מדי - צריך חיפוש מלא
+                logger.info("Gmail history ID expired, falling back to full search")
+                self._last_history_id = None
+                return False
+            raise
+
+        if data.get('history'):
+            logger.info("New messages since last sync, searching again")
+            return False
+
+        self._last_history_id = data.get('historyId', self._last_history_id)
+        return True
+
+    async def get_latest_meitav_email(self) -> dict:
         """
         מציאת המייל האחרון ממיטב עם דוח יומי
 
+        אחרי החיפוש הראשון נשמרים ה-historyId ומזהה המייל האחרון,
+        וקריאות הבאות מחפשות מחדש רק אם הגיעו הודעות חדשות.
+
         Returns:
             dict עם download_url ו-date, או None אם לא נמצא
         """
         try:
+            if await self._mailbox_unchanged():
+                logger.info(f"No new mail since history {self._last_history_id}, using cached email")
+                return self._latest_meitav_email
+
+            # ה-historyId נלקח לפני החיפוש (ולא במקביל אליו) - מייל שמגיע בזמן
+            # החיפוש יופיע ב-history בבדיקה הבאה
+            history_id = (await self.api.get_profile())['historyId']
+
             # חיפוש מיילים ממיטב
             query = 'from:meitavdashnoreply@meitav.co.il subject:"דוח יומי"'
             logger.info(f"Searching for emails with query: {query}")
 
-            results = self.service.users().messages().list(
-                userId='me',
-                q=query,
-                maxResults=5
-            ).execute()
-
-            messages = results.get('messages', [])
+            messages = await self.list_messages(query, max_results=5)
             logger.info(f"Found {len(messages)} messages matching the query")
 
             if not messages:
@@ -94,61 +224,47 @@ class GmailHandler:
                 # ננסה חיפוש רחב יותר
                 logger.info("Trying broader search...")
                 query_broad = 'from:meitavdashnoreply@meitav.co.il'
-                results_broad = self.service.users().messages().list(
-                    userId='me',
-                    q=query_broad,
-                    maxResults=5
-                ).execute()
-                messages = results_broad.get('messages', [])
+                messages = await self.list_messages(query_broad, max_results=5)
                 logger.info(f"Broader search found {len(messages)} messages")
 
                 if not messages:
                     logger.warning("No emails from Meitav found at all")
                     return None
 
+            # אותו מייל כמו בפעם הקודמת - אין צורך להוריד ולפרסר שוב
+            if messages[0]['id'] == self._latest_meitav_id and self._latest_meitav_email:
+                self._last_history_id = history_id
+                logger.info("Latest Meitav email unchanged, using cached email")
+                return self._latest_meitav_email
+
             # קבלת המייל האחרון
-            latest_message = self.service.users().messages().get(
-                userId='me',
-                id=messages[0]['id'],
-                format='full'
-            ).execute()
+            latest_message = await self.get_message(messages[0]['id'])
 
             # חילוץ התאריך מהכותרת
             headers = latest_message['payload']['headers']
             subject = next((h['value'] for h in headers if h['name'] == 'Subject'), '')
             logger.info(f"Email subject: {subject}")
-            date_match = re.search(r'(\d{2}/\d{2}/\d{4})', subject)
+            date_match = SUBJECT_DATE_RE.search(subject)
             report_date = date_match.group(1) if date_match else 'לא ידוע'
 
-            # חיפוש קישור בתוכן המייל
-            body = self._get_email_body(latest_message)
-            html_body = self._get_email_body(latest_message, 'text/html')
-
-            # נסיון למצוא קישור להורדה בגוף המייל
-            download_url = self._extract_download_url(body)
-            if not download_url:
-                download_url = self._extract_download_url(html_body)
-
-            # אם לא מצאנו בגוף המייל, נחפש בקישור של attachment
-            if not download_url:
-                logger.info("No URL in body, checking for SafeMail links in full content")
-                # חיפוש קישורי safemail בכל התוכן
-                all_content = body + html_body
-                safemail_match = re.search(r'(https?://safemail\.meitav\.co\.il/[^\s<>"\']+)', all_content, re.IGNORECASE)
-                if safemail_match:
-                    download_url = safemail_match.group(1)
-                    download_url = download_url.replace('&amp;', '&')
-                    logger.info(f"Found SafeMail URL in content: {download_url}")
+            # חיפוש קישור בתוכן המייל - כל חלק מפוענח פעם אחת
+            download_url = self._extract_download_url(latest_message)
 
             if download_url:
                 logger.info(f"Found download URL for date: {report_date}")
-                return {
+                self._latest_meitav_email = {
+                    'message_id': latest_message['id'],
                     'download_url': download_url,
                     'date': report_date,
                     'subject': subject
                 }
+                self._latest_meitav_id = latest_message['id']
+                self._last_history_id = history_id
+                return self._latest_meitav_email
             else:
                 logger.warning("Could not find download URL in email")
+                body = self._get_email_body(latest_message)
+                html_body = self._get_email_body(latest_message, 'text/html')
                 logger.error(f"Email body (text): {body[:1000] if body else 'EMPTY'}")
                 logger.error(f"Email body (html): {html_body[:1000] if html_body else 'EMPTY'}")
                 return None
@@ -157,57 +273,87 @@ class GmailHandler:
             logger.error(f"Error getting Meitav email: {e}")
             return None
     
+    def _decode_parts(self, message: dict) -> dict:
+        """
+        פענוח כל חלקי ה-MIME של ההודעה במעבר רקורסיבי אחד
+
+        התוצאה נשמרת על ההודעה עצמה, כך שכל חלק מפוענח פעם אחת בלבד.
+
+        Returns:
+            dict של mime type -> רשימת תכנים לפי סדר הופעה
+        """
+        decoded = message.get('_decoded_parts')
+        if decoded is not None:
+            return decoded
+
+        decoded = {}
+
+        def walk(part: dict):
+            data = part.get('body', {}).get('data', '')
+            if data:
+                try:
+                    text = base64.urlsafe_b64decode(data).decode('utf-8', errors='replace')
+                    decoded.setdefault(part.get('mimeType', ''), []).append(text)
+                except Exception as e:
+                    logger.error(f"Error decoding email part: {e}")
+            for subpart in part.get('parts', []):
+                walk(subpart)
+
+        walk(message.get('payload', {}))
+        message['_decoded_parts'] = decoded
+        return decoded
+
     def _get_email_body(self, message: dict, mime_type: str = 'text/plain') -> str:
         """חילוץ תוכן המייל"""
-        try:
-            payload = message['payload']
-            
-            # בדיקה אם יש parts
-            if 'parts' in payload:
-                for part in payload['parts']:
-                    if part['mimeType'] == mime_type:
-                        data = part['body'].get('data', '')
-                        if data:
-                            return base64.urlsafe_b64decode(data).decode('utf-8')
-                    # בדיקה רקורסיבית
-                    if 'parts' in part:
-                        for subpart in part['parts']:
-                            if subpart['mimeType'] == mime_type:
-                                data = subpart['body'].get('data', '')
-                                if data:
-                                    return base64.urlsafe_b64decode(data).decode('utf-8')
-            
-            # אם אין parts, התוכן ישירות ב-body
-            data = payload['body'].get('data', '')
-            if data:
-                return base64.urlsafe_b64decode(data).decode('utf-8')
-            
-            return ''
-            
-        except Exception as e:
-            logger.error(f"Error getting email body: {e}")
-            return ''
-    
-    def _extract_download_url(self, content: str) -> str:
-        """חילוץ קישור ההורדה מתוכן המייל"""
-        if not content:
-            return None
-        
-        # חיפוש קישורים לאתר safemail של מיטב
-        patterns = [
-            r'https://safemail\.meitav\.co\.il/Safe-T/login\.aspx[^\s\'"<>]+',
-            r'https://safemail\.meitav\.co\.il[^\s\'"<>]+',
-            r'href=["\']?(https://safemail\.meitav\.co\.il[^"\'\s<>]+)',
-        ]
-        
-        for pattern in patterns:
-            match = re.search(pattern, content)
-            if match:
-                url = match.group(1) if match.lastindex else match.group(0)
-                # ניקוי ה-URL
-                url = url.rstrip('>')
-                url = url.replace('&amp;', '&')
-                logger.info(f"Found URL: {url}")
-                return url
-        
-        return None
+        parts = self._decode_parts(message).get(mime_type)
+        return parts[0] if parts else ''
+
+    def _extract_download_url(self, message: dict) -> str:
+        """חילוץ קישור ההורדה מתוכן המייל - מעבר יחיד על החלקים המפוענחים"""
+        parts = self._decode_parts(message)
+
+        first_url = None
+        for mime_type in ('text/plain', 'text/html'):
+            for content in parts.get(mime_type, []):
+                for match in SAFEMAIL_URL_RE.finditer(content):
+                    # ניקוי ה-URL
+                    url = match.group(0).rstrip('>').replace('&amp;', '&')
+                    # עדיפות לקישור ה-login של SafeMail
+                    if SAFEMAIL_LOGIN_RE.search(url):
+                        logger.info(f"Found URL: {url}")
+                        return url
+                    if first_url is None:
+                        first_url = url
+
+        if first_url:
+            logger.info(f"Found URL: {first_url}")
+        return first_url
+
+
+# מופע יחיד לכל התהליך
+_gmail_handler = None
+_gmail_handler_lock = None
+
+
+async def get_gmail_handler() -> GmailHandler:
+    """
+    החזרת מופע ה-Gmail המשותף
+
+    האימות (טעינת ה-credentials ורענון ראשון) רץ פעם אחת ב-thread, כך שה-event loop
+    לא נחסם. לאחר מכן ה-token מתרענן ברקע לפני שהוא פג.
+    """
+    global _gmail_handler, _gmail_handler_lock
+
+    if _gmail_handler is not None:
+        return _gmail_handler
+
+    if _gmail_handler_lock is None:
+        _gmail_handler_lock = asyncio.Lock()
+
+    async with _gmail_handler_lock:
+        if _gmail_handler is None:
+            handler = await asyncio.to_thread(GmailHandler)
+            handler.start_token_refresher()
+            _gmail_handler = handler
+
+    return _gmail_handler
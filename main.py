@@ -9,13 +9,16 @@ Meitav Daily Report Bot
 """
 
 import os
+import time
 import asyncio
 import logging
 from telegram import Update, Bot
 from telegram.ext import Application, CommandHandler, MessageHandler, filters, ContextTypes
-from meitav_downloader import MeitavDownloader
-from excel_analyzer import ExcelAnalyzer
-from gmail_handler import GmailHandler
+from report_pipeline import get_report, ReportError
+from gmail_handler import get_gmail_handler
+from browser_pool import get_browser_pool, BROWSER_WARM_UP
+import summary_cache
+import report_store
 
 # Logging
 logging.basicConfig(
@@ -29,6 +32,13 @@ TELEGRAM_TOKEN = os.getenv('TELEGRAM_TOKEN', '8556362815:AAF-qSPbXrWDAcSErRMLpYM
 CHAT_ID = os.getenv('CHAT_ID', '424508467')
 MEITAV_ID = os.getenv('MEITAV_ID', '066624669')
 
+# הורדה מוקדמת ברקע: כל כמה שניות לבדוק אם הגיע מייל חדש (0 - כבוי)
+PREFETCH_INTERVAL = int(os.getenv('PREFETCH_INTERVAL', '300'))
+# שליחת הסיכום ל-CHAT_ID מיד כשדוח חדש מוכן
+PREFETCH_PUSH = os.getenv('PREFETCH_PUSH', '0') == '1'
+# אחרי כישלון - המתנה שמכפילה את עצמה עד המקסימום (שניות), כדי לא להתחבר שוב ושוב
+PREFETCH_MAX_BACKOFF = int(os.getenv('PREFETCH_MAX_BACKOFF', str(6 * 3600)))
+
 
 async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """הודעת פתיחה"""
@@ -45,6 +55,9 @@ async def help_command(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text(
         "📋 *פקודות זמינות:*\n\n"
         "*דוח* - הורדה וניתוח הדוח האחרון\n"
+        "*רענן* - ניתוח מחדש של הדוח האחרון (בלי מטמון)\n"
+        "*מגמה* - ניוד נכנס ב-30 הימים האחרונים\n"
+        "*ממתין <שם>* - כמה זמן עמית ממתין להפקדה ראשונה\n"
         "*סטטוס* - בדיקת סטטוס המערכת\n"
         "*בדיקה* - בדיקת חיבור Gmail ומיילים\n"
         "*עזרה* - הצגת הודעה זו",
@@ -60,7 +73,7 @@ async def status(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     # בדיקת Gmail
     try:
-        gmail = GmailHandler()
+        gmail = await get_gmail_handler()
         status_msg += "📧 Gmail: ✅ מחובר\n"
     except Exception as e:
         status_msg += f"📧 Gmail: ❌ שגיאה - {str(e)}\n"
@@ -83,17 +96,11 @@ async def test_gmail(update: Update, context: ContextTypes.DEFAULT_TYPE):
     await update.message.reply_text("🔍 בודק חיבור ל-Gmail...")
 
     try:
-        gmail = GmailHandler()
+        gmail = await get_gmail_handler()
 
         # חיפוש כל המיילים ממיטב
         query = 'from:meitavdashnoreply@meitav.co.il'
-        results = gmail.service.users().messages().list(
-            userId='me',
-            q=query,
-            maxResults=10
-        ).execute()
-
-        messages = results.get('messages', [])
+        messages = await gmail.list_messages(query, max_results=10)
 
         if not messages:
             await update.message.reply_text(
@@ -106,16 +113,12 @@ async def test_gmail(update: Update, context: ContextTypes.DEFAULT_TYPE):
         # הצגת פרטי המיילים האחרונים
         msg = f"📧 *נמצאו {len(messages)} מיילים ממיטב:*\n\n"
 
-        for i, message in enumerate(messages[:5], 1):
-            msg_data = gmail.service.users().messages().get(
-                userId='me',
-                id=message['id'],
-                format='full'
-            ).execute()
+        # קבלת הכותרות בלבד, במקביל
+        details = await gmail.get_messages_metadata([m['id'] for m in messages[:5]])
 
-            headers = msg_data['payload']['headers']
-            subject = next((h['value'] for h in headers if h['name'] == 'Subject'), 'ללא נושא')
-            date = next((h['value'] for h in headers if h['name'] == 'Date'), 'ללא תאריך')
+        for i, msg_data in enumerate(details, 1):
+            subject = msg_data.get('Subject', 'ללא נושא')
+            date = msg_data.get('Date', 'ללא תאריך')
 
             msg += f"{i}. *{subject}*\n"
             msg += f"   📅 {date}\n\n"
@@ -129,6 +132,21 @@ async def test_gmail(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
 async def request_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
     """הורדה וניתוח הדוח - תהליך אוטומטי מלא"""
+    await send_report(update, force=False)
+
+
+async def refresh_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """הורדה וניתוח מחדש, גם אם הדוח כבר נותח"""
+    await send_report(update, force=True)
+
+
+async def send_report(update: Update, force: bool):
+    """
+    חיפוש המייל האחרון, הורדה, ניתוח ושליחת הסיכום
+
+    Args:
+        force: התעלמות מסיכום שמור של אותו מייל ומהגיליונות השמורים של הקובץ
+    """
     chat_id = str(update.effective_chat.id)
 
     # בדיקת הרשאה
@@ -140,8 +158,8 @@ async def request_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
 
     try:
         # שלב 1: חיפוש המייל האחרון
-        gmail = GmailHandler()
-        email_data = gmail.get_latest_meitav_email()
+        gmail = await get_gmail_handler()
+        email_data = await gmail.get_latest_meitav_email()
 
         if not email_data:
             await update.message.reply_text(
@@ -153,8 +171,16 @@ async def request_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
             )
             return
 
-        download_url = email_data['download_url']
         report_date = email_data['date']
+        message_id = email_data.get('message_id')
+
+        # הדוח של מייל מסוים לא משתנה - סיכום שמור חוסך דפדפן, הורדה וניתוח
+        cached = None if force else summary_cache.get(message_id)
+        if cached:
+            logger.info(f"Serving cached summary for message {message_id}")
+            await update.message.reply_text(cached['summary'], parse_mode='Markdown')
+            await update.message.reply_text("ℹ️ מהמטמון - שלח *רענן* לניתוח מחדש", parse_mode='Markdown')
+            return
 
         await update.message.reply_text(
             f"📧 נמצא דוח מתאריך: *{report_date}*\n\n"
@@ -162,56 +188,113 @@ async def request_report(update: Update, context: ContextTypes.DEFAULT_TYPE):
             parse_mode='Markdown'
         )
 
-        # שלב 2: הפעלת הדפדפן
-        downloader = MeitavDownloader()
-        logger.info("Created MeitavDownloader instance")
-
+        # שלב 2: הורדה וניתוח
         try:
-            logger.info("Starting browser...")
-            await downloader.start()
-            logger.info("Browser started successfully")
-        except Exception as e:
-            logger.error(f"Failed to start browser: {e}")
-            await update.message.reply_text(f"❌ שגיאה באתחול הדפדפן: {str(e)}")
+            report = await get_report(email_data, MEITAV_ID, progress=update.message.reply_text,
+                                      force=force)
+        except ReportError as e:
+            await update.message.reply_text(str(e))
             return
 
-        await update.message.reply_text("⏳ מוריד את הדוח...")
+        # שליחת הדוח
+        await update.message.reply_text(report, parse_mode='Markdown')
 
-        # שלב 3: הורדת הדוח (תהליך אוטומטי - בלי OTP!)
-        try:
-            file_path = await downloader.download_report(download_url, MEITAV_ID)
-        except Exception as e:
-            logger.error(f"Error downloading report: {e}")
-            await downloader.close()
-            await update.message.reply_text(f"❌ שגיאה בהורדת הדוח: {str(e)}")
-            return
+    except Exception as e:
+        logger.error(f"Error in send_report: {e}")
+        await update.message.reply_text(f"❌ שגיאה: {str(e)}")
 
-        await downloader.close()
 
-        if not file_path:
-            await update.message.reply_text("❌ שגיאה בהורדת הקובץ - לא נמצא קובץ xlsx")
-            return
+async def trend(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """מגמת ניוד נכנס מההיסטוריה השמורה"""
+    if str(update.effective_chat.id) != CHAT_ID:
+        await update.message.reply_text("⛔ אין לך הרשאה להשתמש בבוט זה")
+        return
 
-        await update.message.reply_text("📊 מנתח את הדוח...")
+    try:
+        days = await asyncio.to_thread(report_store.trend, 'transfers_in', 30)
+    except Exception as e:
+        logger.error(f"Error in trend: {e}")
+        await update.message.reply_text(f"❌ שגיאה: {str(e)}")
+        return
 
-        # שלב 4: ניתוח הקובץ
-        try:
-            analyzer = ExcelAnalyzer(file_path)
-            report = analyzer.analyze()
+    if not days:
+        await update.message.reply_text("ℹ️ אין עדיין היסטוריה - שלח *דוח* כדי להתחיל", parse_mode='Markdown')
+        return
 
-            # שליחת הדוח
-            await update.message.reply_text(report, parse_mode='Markdown')
-        except Exception as e:
-            logger.error(f"Error analyzing report: {e}")
-            await update.message.reply_text(f"❌ שגיאה בניתוח הדוח: {str(e)}")
+    msg = "📈 *ניוד נכנס - 30 ימים:*\n\n"
+    for day in days:
+        msg += f"{day['date']}: {day['count']} | ₪{day['amount']:,.0f}\n"
+    await update.message.reply_text(msg, parse_mode='Markdown')
 
-        # ניקוי
-        if os.path.exists(file_path):
-            os.remove(file_path)
 
+async def pending(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    """כמה זמן עמית ממתין להפקדה ראשונה"""
+    if str(update.effective_chat.id) != CHAT_ID:
+        await update.message.reply_text("⛔ אין לך הרשאה להשתמש בבוט זה")
+        return
+
+    # "ממתין <שם>" או "/pending <שם>"
+    name = ' '.join(context.args) if context.args else update.message.text.partition(' ')[2].strip()
+    if not name:
+        await update.message.reply_text("שלח *ממתין* ואחריו שם העמית", parse_mode='Markdown')
+        return
+
+    try:
+        result = await asyncio.to_thread(report_store.pending_since, name)
     except Exception as e:
-        logger.error(f"Error in request_report: {e}")
+        logger.error(f"Error in pending: {e}")
         await update.message.reply_text(f"❌ שגיאה: {str(e)}")
+        return
+
+    if not result:
+        await update.message.reply_text(f"ℹ️ {name} לא נמצא ברשימת הממתינים להפקדה")
+        return
+
+    await update.message.reply_text(
+        f"⏳ *{result['name']}*\n"
+        f"ממתין להפקדה ראשונה מאז {result['first_seen']} ({result['days']} ימים)\n"
+        f"הופיע לאחרונה: {result['last_seen']}",
+        parse_mode='Markdown'
+    )
+
+
+async def prefetch_loop(bot: Bot):
+    """
+    בדיקה תקופתית של Gmail - מייל חדש מורד ומנותח מיד ברקע,
+    כך שפקודת "דוח" עונה מהמטמון בלי לחכות
+    """
+    # הבדיקה הראשונה רק מכינה את הדוח הקיים, בלי לשלוח אותו שוב
+    first_poll = True
+    # מיילים שההכנה שלהם נכשלה: message ID -> (מספר כישלונות, זמן הניסיון הבא)
+    failures = {}
+
+    while True:
+        message_id = None
+        try:
+            gmail = await get_gmail_handler()
+            email_data = await gmail.get_latest_meitav_email()
+            message_id = email_data.get('message_id') if email_data else None
+
+            attempts, retry_at = failures.get(message_id, (0, 0))
+            if message_id and not summary_cache.get(message_id) and time.monotonic() >= retry_at:
+                logger.info(f"Prefetching report for message {message_id}")
+                report = await get_report(email_data, MEITAV_ID)
+                logger.info(f"Prefetched report for {email_data['date']}")
+                failures.pop(message_id, None)
+
+                if PREFETCH_PUSH and not first_poll:
+                    await bot.send_message(chat_id=CHAT_ID, text=report, parse_mode='Markdown')
+
+            first_poll = False
+        except ReportError as e:
+            attempts += 1
+            backoff = min(PREFETCH_INTERVAL * 2 ** attempts, PREFETCH_MAX_BACKOFF)
+            failures = {message_id: (attempts, time.monotonic() + backoff)}
+            logger.error(f"Prefetch failed ({attempts} attempts), retrying in {backoff}s: {e}")
+        except Exception as e:
+            logger.error(f"Error in prefetch loop: {e}")
+
+        await asyncio.sleep(PREFETCH_INTERVAL)
 
 
 if __name__ == '__main__':
@@ -236,11 +319,23 @@ if __name__ == '__main__':
         await site.start()
         logger.info(f"Health check server running on port {port}")
 
+    async def warm_up_gmail():
+        """אימות Gmail מראש ברקע - כדי שהפקודה הראשונה לא תחכה"""
+        try:
+            await get_gmail_handler()
+        except Exception as e:
+            logger.error(f"Gmail warm-up failed: {e}")
+
     # הרצת שני הדברים במקביל
     async def run_both():
         # הפעלת web server
         await start_web_server()
 
+        # חיבור Gmail ברקע; דפדפן חם רק אם הופעל במפורש (אחרת נפתח בשימוש הראשון)
+        gmail_warm_up = asyncio.create_task(warm_up_gmail())
+        if BROWSER_WARM_UP:
+            browser_warm_up = asyncio.create_task(get_browser_pool().warm_up())
+
         # הפעלת הבוט באותו event loop
         application = Application.builder().token(TELEGRAM_TOKEN).build()
 
@@ -249,10 +344,16 @@ if __name__ == '__main__':
         application.add_handler(CommandHandler("help", help_command))
         application.add_handler(CommandHandler("status", status))
         application.add_handler(CommandHandler("test_gmail", test_gmail))
+        application.add_handler(CommandHandler("refresh", refresh_report))
+        application.add_handler(CommandHandler("trend", trend))
+        application.add_handler(CommandHandler("pending", pending))
         application.add_handler(MessageHandler(filters.Regex(r'^(עזרה|help)$'), help_command))
         application.add_handler(MessageHandler(filters.Regex(r'^(סטטוס|status)$'), status))
         application.add_handler(MessageHandler(filters.Regex(r'^(בדיקה|test)$'), test_gmail))
         application.add_handler(MessageHandler(filters.Regex(r'^(דוח|דו"ח|report)$'), request_report))
+        application.add_handler(MessageHandler(filters.Regex(r'^(רענן|refresh)$'), refresh_report))
+        application.add_handler(MessageHandler(filters.Regex(r'^(מגמה|trend)$'), trend))
+        application.add_handler(MessageHandler(filters.Regex(r'^(ממתין|pending)(\s|$)'), pending))
 
         # הפעלת הבוט
         logger.info("Starting bot...")
@@ -260,6 +361,10 @@ if __name__ == '__main__':
         await application.start()
         await application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
 
+        # הורדה מוקדמת של דוחות חדשים ברקע
+        if PREFETCH_INTERVAL > 0:
+            prefetch = asyncio.create_task(prefetch_loop(application.bot))
+
         # שמירה על התהליך חי
         while True:
             await asyncio.sleep(3600)
@@ -2,19 +2,121 @@
 Meitav Downloader
 =================
 הורדת קבצים מאתר מיטב באמצעות Pyppeteer
-תומך בדפדפן מקומי או דפדפן מרוחק (Browserless.io)
+הדפדפנים מגיעים ממאגר משותף (browser_pool)
 """
 
 import os
+import io
+import re
+import time
+import uuid
 import asyncio
+import hashlib
 import logging
 import aiohttp
+from typing import Union
+from urllib.parse import urlparse
+import session_cache
+from browser_pool import get_browser_pool
+from safemail_http import (
+    http_login, session_download_link, pick_download_link, find_download_href,
+    UnrecognizedLoginForm, NoDownloadLink
+)
 
 logger = logging.getLogger(__name__)
 
-# Browserless.io - שירות דפדפן מרוחק חינמי
-BROWSERLESS_URL = os.getenv('BROWSERLESS_URL', 'wss://chrome.browserless.io')
-BROWSERLESS_TOKEN = os.getenv('BROWSERLESS_TOKEN', '')
+# זמני המתנה מקסימליים (מילישניות) לכל שלב
+PAGE_READY_TIMEOUT = int(os.getenv('MEITAV_PAGE_READY_TIMEOUT', '15000'))
+LOGIN_NAV_TIMEOUT = int(os.getenv('MEITAV_LOGIN_NAV_TIMEOUT', '30000'))
+DOCUMENTS_TIMEOUT = int(os.getenv('MEITAV_DOCUMENTS_TIMEOUT', '20000'))
+
+# התחברות ב-HTTP בלבד לפני שמפעילים דפדפן
+HTTP_LOGIN_ENABLED = os.getenv('MEITAV_HTTP_LOGIN', '1') != '0'
+HTTP_TIMEOUT = float(os.getenv('MEITAV_HTTP_TIMEOUT', '60'))
+
+# הורדת הקובץ
+DOWNLOAD_CHUNK_SIZE = 256 * 1024
+DOWNLOAD_RETRIES = int(os.getenv('MEITAV_DOWNLOAD_RETRIES', '3'))
+# קבצים עד הגודל הזה נשארים בזיכרון ולא נכתבים לדיסק
+SPILL_THRESHOLD = int(os.getenv('MEITAV_SPILL_THRESHOLD', str(32 * 1024 * 1024)))
+
+CONTENT_RANGE_RE = re.compile(r'bytes\s+(\d+)-\d+/(\d+)')
+FILENAME_RE = re.compile(r'filename[*]?=["\']?([^"\';\n]+)')
+
+USER_AGENT = 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
+
+# מאגר חיבורים משותף לכל בקשות ה-HTTP
+_connector = None
+_download_session = None
+
+
+def _get_connector() -> aiohttp.TCPConnector:
+    global _connector
+    if _connector is None or _connector.closed:
+        _connector = aiohttp.TCPConnector(limit=20, keepalive_timeout=60)
+    return _connector
+
+
+def _get_download_session() -> aiohttp.ClientSession:
+    """session משותף להורדות - הקוקיז נשלחים בכל בקשה בנפרד"""
+    global _download_session
+    if _download_session is None or _download_session.closed:
+        _download_session = aiohttp.ClientSession(
+            connector=_get_connector(),
+            connector_owner=False,
+            cookie_jar=aiohttp.DummyCookieJar(),
+            timeout=aiohttp.ClientTimeout(total=None, sock_connect=30, sock_read=HTTP_TIMEOUT)
+        )
+    return _download_session
+
+
+# הופעת קישור לקובץ בעמוד המסמכים
+DOCUMENTS_READY_JS = """() => Array.from(document.querySelectorAll('a')).some(
+    a => /\\.xlsx|download|attachment/i.test((a.href || '') + ' ' + (a.innerText || '')))"""
+
+# איסוף כל המועמדים (שדות, כפתורים, קישורים) ב-evaluate אחד
+# כל אלמנט מסומן ב-data attribute כדי שאפשר יהיה לפנות אליו אחר כך
+DISCOVERY_JS = """() => {
+    const visible = el => el.offsetParent !== null && el.offsetHeight > 0;
+    const tag = (el, attr, i) => { el.setAttribute(attr, String(i)); return `[${attr}="${i}"]`; };
+
+    const inputs = Array.from(document.querySelectorAll('input')).map((el, i) => ({
+        selector: tag(el, 'data-meitav-input', i),
+        type: el.type || '',
+        name: el.name || '',
+        visible: visible(el)
+    }));
+
+    const buttons = Array.from(document.querySelectorAll(
+        'button, input[type="submit"], .btn, [type="button"]'
+    )).map((el, i) => ({
+        selector: tag(el, 'data-meitav-button', i),
+        type: el.type || '',
+        text: el.innerText || el.value || ''
+    }));
+
+    const links = Array.from(document.querySelectorAll('a')).map(el => ({
+        href: el.href || '',
+        text: el.innerText || ''
+    }));
+
+    const xlsxElements = Array.from(document.querySelectorAll('a, span, div, td'))
+        .filter(el => (el.innerText || '').includes('.xlsx'))
+        .map(el => ({
+            text: el.innerText.slice(0, 200),
+            onclick: el.onclick ? el.onclick.toString().slice(0, 100) : '',
+            href: el.href || (el.parentElement && el.parentElement.href) || ''
+        }));
+
+    return {inputs, buttons, links, xlsxElements};
+}"""
+
+# הזנת ערך לשדה והפעלת אירוע input
+FILL_INPUT_JS = """(selector, value) => {
+    const el = document.querySelector(selector);
+    el.value = value;
+    el.dispatchEvent(new Event("input", { bubbles: true }));
+}"""
 
 
 class MeitavDownloader:
@@ -22,44 +124,140 @@ class MeitavDownloader:
         self.browser = None
         self.page = None
         self.download_path = "/tmp/meitav_downloads"
+        # מזהה הריצה - כל הורדה נכתבת לקובץ משלה גם כשיש כמה במקביל
+        self.run_id = uuid.uuid4().hex[:12]
         self.cookies = []
+        # עמוד המסמכים אחרי ההתחברות - נשמר עם הקוקיז
+        self.documents_url = None
+        self.file_sha256 = None
+        self._lease = None
 
     async def start(self):
-        """הפעלת הדפדפן - מקומי או מרוחק"""
-        import pyppeteer
-
+        """קבלת דפדפן חם מהמאגר עם context נקי"""
         os.makedirs(self.download_path, exist_ok=True)
 
-        # אם יש טוקן של Browserless - השתמש בדפדפן מרוחק
-        if BROWSERLESS_TOKEN:
-            browserless_ws = f"{BROWSERLESS_URL}?token={BROWSERLESS_TOKEN}"
-            logger.info(f"Connecting to remote browser (Browserless.io)...")
-            logger.info(f"WebSocket URL: {BROWSERLESS_URL}?token=***")
-            try:
-                self.browser = await pyppeteer.connect(browserWSEndpoint=browserless_ws)
-                logger.info("Connected to Browserless.io successfully!")
-            except Exception as e:
-                logger.error(f"Failed to connect to Browserless: {e}")
-                raise Exception(f"Browserless connection failed: {e}")
-        else:
-            # דפדפן מקומי
-            logger.info("No BROWSERLESS_TOKEN found, starting local browser...")
-            self.browser = await pyppeteer.launch(
-                headless=True,
-                args=['--no-sandbox', '--disable-setuid-sandbox', '--disable-dev-shm-usage']
-            )
+        self._lease = await get_browser_pool().acquire()
+        self.browser = self._lease.entry.browser
+        self.page = self._lease.page
 
-        self.page = await self.browser.newPage()
+        logger.info("Browser started")
 
-        # הגדרת timeout
-        self.page.setDefaultNavigationTimeout(60000)
+    async def _timed_wait(self, step: str, awaitable, required: bool = True):
+        """
+        המתנה לתנאי עם רישום הזמן בפועל
 
-        logger.info("Browser started")
+        Args:
+            step: שם השלב ללוג
+            awaitable: ההמתנה עצמה (עם timeout משלה)
+            required: אם False - חריגת זמן נרשמת בלוג והתהליך ממשיך
+        """
+        started = time.monotonic()
+        try:
+            return await awaitable
+        except Exception as e:
+            if required:
+                raise
+            logger.warning(f"Wait '{step}' did not complete: {e}")
+            return None
+        finally:
+            logger.info(f"Wait '{step}' took {time.monotonic() - started:.2f}s")
 
-    async def download_report(self, url: str, id_number: str) -> str:
+    async def download_report(self, url: str, id_number: str) -> Union[str, io.BytesIO, None]:
         """
         הורדת הדוח מאתר מיטב
 
+        קודם מנסה session שמור, אחר כך התחברות ב-HTTP בלבד. הדפדפן
+        מופעל רק אם מבנה הדף לא מוכר.
+
+        Args:
+            url: קישור ההורדה מהמייל
+            id_number: תעודת זהות
+
+        Returns:
+            נתיב הקובץ שהורד, io.BytesIO עם תוכן הקובץ (קבצים קטנים), או None
+        """
+        host = urlparse(url).hostname or ''
+
+        report_file = await self._download_with_cached_session(url, id_number, host)
+        if report_file:
+            return report_file
+
+        if HTTP_LOGIN_ENABLED:
+            # חוזרים לדפדפן רק כשטופס ההתחברות לא מוכר - לפני שתעודת הזהות נשלחה.
+            # כל שגיאה אחרי השליחה (גם עמוד מסמכים בלי קובץ) לא נשלחת שוב בדפדפן
+            try:
+                report_file = await self._download_report_http(url, id_number)
+            except UnrecognizedLoginForm as e:
+                logger.info(f"HTTP login not applicable ({e}), falling back to browser")
+            except NoDownloadLink as e:
+                logger.warning(f"HTTP login succeeded but found no report file: {e}")
+                return None
+            else:
+                if report_file:
+                    session_cache.save(id_number, host, self.cookies, self.documents_url, url)
+                return report_file
+
+        if self.page is None:
+            await self.start()
+
+        report_file = await self._download_report_browser(url, id_number)
+        if report_file:
+            session_cache.save(id_number, host, self.cookies, self.documents_url, url)
+        return report_file
+
+    def _http_session(self, **kwargs) -> aiohttp.ClientSession:
+        """session קצר-מועד על מאגר החיבורים המשותף"""
+        return aiohttp.ClientSession(
+            connector=_get_connector(),
+            connector_owner=False,
+            headers={'User-Agent': USER_AGENT},
+            timeout=aiohttp.ClientTimeout(total=HTTP_TIMEOUT),
+            **kwargs
+        )
+
+    async def _download_with_cached_session(self, url: str, id_number: str, host: str) -> Union[str, io.BytesIO, None]:
+        """הורדה עם קוקיז שמורים - בלי התחברות. מחזיר None אם ה-session נדחה"""
+        cookies, documents_url = session_cache.load(id_number, host, url)
+        if not cookies:
+            return None
+
+        # ה-session נשמר מהתחברות לאותו קישור - בודקים את עמוד המסמכים שנשמר איתו
+        try:
+            async with self._http_session(cookie_jar=aiohttp.DummyCookieJar()) as session:
+                download_url, file_name = await session_download_link(session, documents_url, cookies)
+        except Exception as e:
+            logger.warning(f"Cached session check failed: {e}")
+            return None
+
+        if not download_url:
+            logger.info("Cached SafeMail session rejected, logging in again")
+            session_cache.invalidate(id_number, host)
+            return None
+
+        logger.info("Reusing cached SafeMail session")
+        self.cookies = cookies
+        self.documents_url = documents_url
+        return await self._download_file(download_url, file_name)
+
+    async def _download_report_http(self, url: str, id_number: str) -> Union[str, io.BytesIO, None]:
+        """התחברות והורדה בלי דפדפן"""
+        os.makedirs(self.download_path, exist_ok=True)
+        started = time.monotonic()
+
+        jar = aiohttp.CookieJar(unsafe=True)
+        async with self._http_session(cookie_jar=jar) as session:
+            download_url, file_name, self.documents_url = await http_login(session, url, id_number)
+
+        self.cookies = [{'name': c.key, 'value': c.value, 'expires': c['expires']} for c in jar]
+        logger.info(f"HTTP login done in {time.monotonic() - started:.2f}s, got {len(self.cookies)} cookies")
+        logger.info(f"Downloading file from: {download_url}")
+
+        return await self._download_file(download_url, file_name)
+
+    async def _download_report_browser(self, url: str, id_number: str) -> Union[str, io.BytesIO, None]:
+        """
+        הורדת הדוח דרך הדפדפן
+
         התהליך:
         1. כניסה לקישור
         2. הזנת תעודת זהות
@@ -75,46 +273,32 @@ class MeitavDownloader:
         """
         try:
             logger.info(f"Navigating to: {url}")
-            await self.page.goto(url, {'waitUntil': 'networkidle0'})
-
-            # מחכה לטעינת הדף
-            await asyncio.sleep(3)
+            await self._timed_wait('navigation', self.page.goto(
+                url, {'waitUntil': 'domcontentloaded', 'timeout': LOGIN_NAV_TIMEOUT}
+            ))
 
             # שלב 1: מחפש את שדה הסיסמה (truePass)
             logger.info("Looking for password field (truePass)...")
 
-            # מחכה שהדף יהיה מוכן
-            await self.page.waitForSelector('input', {'timeout': 15000})
+            # מחכה ששדה קלט גלוי יופיע
+            await self._timed_wait('login form', self.page.waitForSelector(
+                'input:not([type="hidden"])', {'visible': True, 'timeout': PAGE_READY_TIMEOUT}
+            ))
 
-            # מדפיס את כל ה-inputs לדיבוג
-            inputs = await self.page.querySelectorAll('input')
-            logger.info(f"Found {len(inputs)} input elements")
+            # סריקת הדף - פנייה אחת לדפדפן
+            dom = await self._discover()
 
-            for i, inp in enumerate(inputs):
-                try:
-                    inp_type = await self.page.evaluate('(el) => el.type', inp)
-                    inp_name = await self.page.evaluate('(el) => el.name', inp)
-                    inp_visible = await self.page.evaluate('(el) => el.offsetParent !== null', inp)
-                    logger.info(f"Input {i}: type={inp_type}, name={inp_name}, visible={inp_visible}")
-                except:
-                    pass
-
-            password_field = None
+            # מדפיס את כל ה-inputs לדיבוג
+            logger.info(f"Found {len(dom['inputs'])} input elements")
+            for i, inp in enumerate(dom['inputs']):
+                logger.info(f"Input {i}: type={inp['type']}, name={inp['name']}, visible={inp['visible']}")
 
             # מחפש שדה visible
-            for inp in inputs:
-                try:
-                    is_visible = await self.page.evaluate('(el) => el.offsetParent !== null && el.offsetHeight > 0', inp)
-                    inp_type = await self.page.evaluate('(el) => el.type', inp)
-                    inp_name = await self.page.evaluate('(el) => el.name || ""', inp)
-
-                    if is_visible and inp_type in ['text', 'password', 'tel']:
-                        password_field = inp
-                        logger.info(f"Found visible input field: type={inp_type}, name={inp_name}")
-                        break
-                except Exception as e:
-                    logger.debug(f"Error checking input: {e}")
-                    continue
+            password_field = next(
+                (inp for inp in dom['inputs']
+                 if inp['visible'] and inp['type'] in ['text', 'password', 'tel']),
+                None
+            )
 
             if not password_field:
                 logger.error("Could not find visible password field")
@@ -123,82 +307,56 @@ class MeitavDownloader:
                 logger.info(f"Page HTML snippet: {page_html[:1500]}")
                 return None
 
+            logger.info(f"Found visible input field: type={password_field['type']}, name={password_field['name']}")
+
             # שלב 2: הזנת תעודת הזהות - משתמש ב-JavaScript
             logger.info("Entering ID number using JavaScript...")
-            await self.page.evaluate(f'(el) => {{ el.value = "{id_number}"; el.dispatchEvent(new Event("input", {{ bubbles: true }})); }}', password_field)
+            await self.page.evaluate(FILL_INPUT_JS, password_field['selector'], id_number)
             logger.info("ID number entered")
 
-            await asyncio.sleep(1)
-
             # שלב 3: לחיצה על כפתור התחבר
             logger.info("Looking for submit button...")
 
-            clicked = False
             # מחפש כפתור עם הטקסט "התחבר"
-            buttons = await self.page.querySelectorAll('button, input[type="submit"], .btn, [type="button"]')
-            for button in buttons:
-                try:
-                    text = await self.page.evaluate('(el) => el.innerText || el.value || ""', button)
-                    if 'התחבר' in text or 'כניסה' in text or 'login' in text.lower() or 'submit' in text.lower():
-                        await button.click()
-                        logger.info(f"Clicked button: {text}")
-                        clicked = True
-                        break
-                except:
-                    continue
+            button = next(
+                (b for b in dom['buttons']
+                 if 'התחבר' in b['text'] or 'כניסה' in b['text']
+                 or 'login' in b['text'].lower() or 'submit' in b['text'].lower()),
+                None
+            )
+            if button:
+                logger.info(f"Found button: {button['text']}")
+            else:
+                button = next((b for b in dom['buttons'] if b['type'] == 'submit'), None)
+                if button:
+                    logger.info("Found submit input")
 
-            if not clicked:
-                try:
-                    submit_btn = await self.page.querySelector('input[type="submit"]')
-                    if submit_btn:
-                        await submit_btn.click()
-                        clicked = True
-                        logger.info("Clicked submit input")
-                except:
-                    pass
-
-            if not clicked:
+            submit_button = await self.page.querySelector(button['selector']) if button else None
+
+            if not submit_button:
                 logger.error("Could not find submit button")
                 return None
 
-            # מחכה לטעינת הדף הבא (עמוד המסמכים)
-            logger.info("Waiting for documents page...")
-            await asyncio.sleep(5)
+            await self._submit_and_wait(submit_button)
 
             # שומר את הקוקיז לשימוש בהורדה
             self.cookies = await self.page.cookies()
+            self.documents_url = self.page.url
             logger.info(f"Got {len(self.cookies)} cookies")
 
             # שלב 4: חיפוש URL של הקובץ להורדה
             logger.info("Looking for download URL...")
 
-            download_url = None
-            file_name = None
+            # סריקת עמוד המסמכים - פנייה אחת לדפדפן
+            dom = await self._discover()
 
             # מחפש קישורים עם href שמכיל xlsx או download
-            links = await self.page.querySelectorAll('a')
-            for link in links:
-                try:
-                    href = await self.page.evaluate('(el) => el.href || ""', link)
-                    text = await self.page.evaluate('(el) => el.innerText || ""', link)
-
-                    logger.info(f"Found link: href={href[:100] if href else 'none'}, text={text[:50] if text else 'none'}")
+            for link in dom['links']:
+                logger.info(f"Found link: href={link['href'][:100] or 'none'}, text={link['text'][:50] or 'none'}")
 
-                    if href and ('.xlsx' in href.lower() or 'download' in href.lower() or 'attachment' in href.lower()):
-                        download_url = href
-                        file_name = text.strip() if text else "report.xlsx"
-                        logger.info(f"Found download URL: {download_url}")
-                        break
-
-                    # מחפש גם לפי טקסט
-                    if '.xlsx' in text.lower():
-                        download_url = href
-                        file_name = text.strip()
-                        logger.info(f"Found xlsx by text: {text}")
-                        break
-                except Exception as e:
-                    logger.debug(f"Error checking link: {e}")
-                    continue
+            download_url, file_name = pick_download_link(dom['links'])
+            if download_url:
+                logger.info(f"Found download URL: {download_url}")
 
             # אם לא מצאנו, ננסה לחפש בכל הדף
             if not download_url:
@@ -206,38 +364,26 @@ class MeitavDownloader:
                 logger.info(f"Page URL: {self.page.url}")
 
                 # מחפש URL בתוכן הדף
-                import re
-                urls = re.findall(r'href=["\']([^"\']*(?:download|attachment|xlsx)[^"\']*)["\']', page_content, re.IGNORECASE)
-                if urls:
-                    download_url = urls[0]
-                    if not download_url.startswith('http'):
-                        # יצירת URL מלא
-                        base_url = '/'.join(self.page.url.split('/')[:3])
-                        download_url = base_url + download_url if download_url.startswith('/') else base_url + '/' + download_url
+                download_url = find_download_href(page_content, self.page.url)
+                if download_url:
                     logger.info(f"Found URL in content: {download_url}")
 
             if not download_url:
                 # ננסה גישה אחרת - ללחוץ על הקישור ולתפוס את ה-response
                 logger.info("Trying click-and-intercept approach...")
 
-                # מחפש אלמנט עם טקסט xlsx
-                elements = await self.page.querySelectorAll('a, span, div, td')
-                for el in elements:
-                    try:
-                        text = await self.page.evaluate('(el) => el.innerText || ""', el)
-                        if '.xlsx' in text:
-                            # מנסה לקבל את ה-onclick או href
-                            onclick = await self.page.evaluate('(el) => el.onclick ? el.onclick.toString() : ""', el)
-                            href = await self.page.evaluate('(el) => el.href || el.parentElement?.href || ""', el)
-
-                            logger.info(f"Found xlsx element: text={text}, onclick={onclick[:100] if onclick else 'none'}, href={href}")
-
-                            if href:
-                                download_url = href
-                                file_name = text.strip()
-                                break
-                    except:
-                        continue
+                # מחפש אלמנט עם טקסט xlsx (כבר נאסף בסריקה)
+                for el in dom['xlsxElements']:
+                    text = el['text']
+                    onclick = el['onclick']
+                    href = el['href']
+
+                    logger.info(f"Found xlsx element: text={text}, onclick={onclick if onclick else 'none'}, href={href}")
+
+                    if href:
+                        download_url = href
+                        file_name = text.strip()
+                        break
 
             if not download_url:
                 logger.error("Could not find download URL")
@@ -249,11 +395,11 @@ class MeitavDownloader:
             # שלב 5: הורדת הקובץ ישירות דרך HTTP
             logger.info(f"Downloading file from: {download_url}")
 
-            file_path = await self._download_file(download_url, file_name)
+            report_file = await self._download_file(download_url, file_name)
 
-            if file_path:
-                logger.info(f"File downloaded successfully: {file_path}")
-                return file_path
+            if report_file:
+                logger.info("File downloaded successfully")
+                return report_file
 
             logger.warning("Failed to download file")
             return None
@@ -262,57 +408,175 @@ class MeitavDownloader:
             logger.error(f"Error in download_report: {e}")
             import traceback
             logger.error(traceback.format_exc())
+            # דפדפן שנכשל באמצע לא חוזר למאגר
+            if self._lease:
+                self._lease.healthy = False
             return None
 
-    async def _download_file(self, url: str, file_name: str = None) -> str:
-        """הורדת קובץ ישירות דרך HTTP עם הקוקיז מהדפדפן"""
+    async def _discover(self) -> dict:
+        """סריקת כל המועמדים בדף ב-evaluate יחיד"""
+        started = time.monotonic()
+        dom = await self.page.evaluate(DISCOVERY_JS)
+        logger.info(
+            f"DOM discovery: {len(dom['inputs'])} inputs, {len(dom['buttons'])} buttons, "
+            f"{len(dom['links'])} links in {time.monotonic() - started:.2f}s"
+        )
+        return dom
+
+    async def _submit_and_wait(self, submit_button):
+        """לחיצה על התחבר והמתנה לניווט ולהופעת רשימת המסמכים"""
+        # ההמתנה לניווט מתחילה לפני הלחיצה כדי לא לפספס אותו
+        navigation = asyncio.ensure_future(self.page.waitForNavigation(
+            {'waitUntil': 'domcontentloaded', 'timeout': LOGIN_NAV_TIMEOUT}
+        ))
+        await submit_button.click()
+        logger.info("Clicked submit button")
+
+        # ASP.NET יכול לעדכן את הדף בלי ניווט מלא - לכן לא חובה
+        await self._timed_wait('login navigation', navigation, required=False)
+
+        # מחכה לטעינת הדף הבא (עמוד המסמכים)
+        logger.info("Waiting for documents page...")
+        await self._timed_wait('documents list', self.page.waitForFunction(
+            DOCUMENTS_READY_JS, {'timeout': DOCUMENTS_TIMEOUT}
+        ), required=False)
+
+    async def _download_file(self, url: str, file_name: str = None) -> Union[str, io.BytesIO, None]:
+        """
+        הורדת קובץ ישירות דרך HTTP עם הקוקיז מהדפדפן
+
+        התוכן נשמר בזיכרון בחלקים תוך כדי הורדה, ונכתב לדיסק רק אם הוא
+        גדול מ-SPILL_THRESHOLD. אם החיבור נקטע, ההורדה ממשיכה מאותה נקודה
+        (Range). בסוף נבדק Content-Length ונשמר SHA-256.
+
+        Returns:
+            io.BytesIO (עם name), נתיב קובץ בדיסק, או None
+        """
+        # יצירת headers עם cookies
+        cookie_header = '; '.join([f"{c['name']}={c['value']}" for c in self.cookies])
+
+        headers = {
+            'Cookie': cookie_header,
+            'User-Agent': USER_AGENT
+        }
+
+        session = _get_download_session()
+        started = time.monotonic()
+        file_path = None
+        target_name = None
+        f = None
+        completed = False
+        written = 0
+        expected_size = None
+        sha256 = hashlib.sha256()
+
         try:
-            # יצירת headers עם cookies
-            cookie_header = '; '.join([f"{c['name']}={c['value']}" for c in self.cookies])
-
-            headers = {
-                'Cookie': cookie_header,
-                'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'
-            }
-
-            async with aiohttp.ClientSession() as session:
-                async with session.get(url, headers=headers, ssl=False) as response:
-                    if response.status == 200:
-                        # קביעת שם הקובץ
-                        if not file_name or not file_name.endswith('.xlsx'):
-                            # מנסה לקבל מ-Content-Disposition
-                            cd = response.headers.get('Content-Disposition', '')
-                            if 'filename=' in cd:
-                                import re
-                                match = re.search(r'filename[*]?=["\']?([^"\';\n]+)', cd)
-                                if match:
-                                    file_name = match.group(1).strip()
-
-                            if not file_name or not file_name.endswith('.xlsx'):
-                                file_name = 'meitav_report.xlsx'
-
-                        file_path = os.path.join(self.download_path, file_name)
-
-                        # שמירת הקובץ
-                        content = await response.read()
-                        with open(file_path, 'wb') as f:
-                            f.write(content)
-
-                        logger.info(f"Downloaded {len(content)} bytes to {file_path}")
-                        return file_path
-                    else:
-                        logger.error(f"Download failed with status {response.status}")
-                        return None
+            for attempt in range(DOWNLOAD_RETRIES + 1):
+                request_headers = dict(headers)
+                if written:
+                    request_headers['Range'] = f'bytes={written}-'
+
+                try:
+                    async with session.get(url, headers=request_headers) as response:
+                        if response.status == 206:
+                            match = CONTENT_RANGE_RE.search(response.headers.get('Content-Range', ''))
+                            if not match or int(match.group(1)) != written:
+                                logger.error("Unexpected Content-Range on resume")
+                                return None
+                            expected_size = int(match.group(2))
+                        elif response.status == 200:
+                            if written:
+                                # השרת התעלם מ-Range - מתחילים מחדש
+                                logger.info("Server ignored Range header, restarting download")
+                                f.seek(0)
+                                f.truncate()
+                                written = 0
+                                sha256 = hashlib.sha256()
+                            expected_size = response.content_length
+                        else:
+                            logger.error(f"Download failed with status {response.status}")
+                            return None
+
+                        if f is None:
+                            target_name = self._resolve_file_name(file_name, response)
+                            f = io.BytesIO()
+
+                        # שמירת הקובץ בחלקים
+                        async for chunk in response.content.iter_chunked(DOWNLOAD_CHUNK_SIZE):
+                            sha256.update(chunk)
+                            if file_path is None and max(written + len(chunk), expected_size or 0) > SPILL_THRESHOLD:
+                                file_path, f = await self._spill_to_disk(target_name, f)
+                            if file_path is None:
+                                f.write(chunk)
+                            else:
+                                await asyncio.to_thread(f.write, chunk)
+                            written += len(chunk)
+
+                    break
+
+                except (aiohttp.ClientPayloadError, aiohttp.ClientConnectionError, asyncio.TimeoutError) as e:
+                    if attempt == DOWNLOAD_RETRIES:
+                        raise
+                    logger.warning(f"Download interrupted after {written} bytes ({e}), resuming")
+
+            if expected_size is not None and written != expected_size:
+                logger.error(f"Download size mismatch: got {written} bytes, expected {expected_size}")
+                return None
+
+            completed = True
+            self.file_sha256 = sha256.hexdigest()
+            logger.info(
+                f"Downloaded {written} bytes to {file_path or 'memory'} in {time.monotonic() - started:.2f}s "
+                f"(sha256={self.file_sha256[:12]})"
+            )
+
+            if file_path is None:
+                f.seek(0)
+                f.name = target_name
+                return f
+            return file_path
 
         except Exception as e:
             logger.error(f"Error downloading file: {e}")
             return None
 
+        finally:
+            if file_path is not None:
+                await asyncio.to_thread(f.close)
+            # לא משאירים קובץ חלקי
+            if not completed and file_path and os.path.exists(file_path):
+                os.remove(file_path)
+
+    async def _spill_to_disk(self, file_name: str, buffer: io.BytesIO) -> tuple:
+        """העברת ההורדה מהזיכרון לקובץ בדיסק (קבצים גדולים)"""
+        os.makedirs(self.download_path, exist_ok=True)
+        file_path = os.path.join(self.download_path, f"{self.run_id}_{os.path.basename(file_name)}")
+        logger.info(f"Download exceeds {SPILL_THRESHOLD} bytes, spilling to {file_path}")
+
+        f = await asyncio.to_thread(open, file_path, 'w+b')
+        await asyncio.to_thread(f.write, buffer.getvalue())
+        return file_path, f
+
+    def _resolve_file_name(self, file_name: str, response) -> str:
+        """קביעת שם הקובץ"""
+        if not file_name or not file_name.endswith('.xlsx'):
+            # מנסה לקבל מ-Content-Disposition
+            cd = response.headers.get('Content-Disposition', '')
+            match = FILENAME_RE.search(cd) if 'filename=' in cd else None
+            if match:
+                file_name = match.group(1).strip()
+
+            if not file_name or not file_name.endswith('.xlsx'):
+                file_name = 'meitav_report.xlsx'
+
+        return file_name
+
     async def close(self):
-        """סגירת הדפדפן"""
+        """החזרת הדפדפן למאגר"""
         try:
-            if self.browser:
-                await self.browser.close()
-            logger.info("Browser closed")
+            if self._lease:
+                await get_browser_pool().release(self._lease)
+                self._lease = None
+            logger.info("Browser released")
         except Exception as e:
             logger.error(f"Error closing browser: {e}")
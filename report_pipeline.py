@@ -0,0 +1,153 @@
+"""
+Report Pipeline
+===============
+התהליך המלא למייל אחד: הורדת הדוח, ניתוח ושמירת הסיכום
+משמש גם את פקודת "דוח" וגם את ההורדה המוקדמת ברקע
+"""
+
+import os
+import asyncio
+import logging
+from meitav_downloader import MeitavDownloader
+from excel_analyzer import analyze_report
+import summary_cache
+import report_store
+
+logger = logging.getLogger(__name__)
+
+
+class ReportError(Exception):
+    """שלב בתהליך נכשל - ההודעה מוכנה להצגה למשתמש"""
+
+
+async def _no_progress(text: str):
+    pass
+
+
+def _safe_progress(progress):
+    """דיווח התקדמות שלא מכשיל את הריצה - הריצה משותפת לכל הממתינים"""
+    async def report(text: str):
+        try:
+            await progress(text)
+        except Exception as e:
+            logger.warning(f"Could not send progress update: {e}")
+    return report
+
+
+# משימות רקע של שמירת היסטוריה - שמורות כדי שלא ייאספו באמצע
+_history_tasks = set()
+
+
+def _remove_report_file(report_file):
+    """ניקוי - רק קבצים גדולים נכתבים לדיסק"""
+    if isinstance(report_file, str) and os.path.exists(report_file):
+        os.remove(report_file)
+
+
+def _save_history(email_data: dict, analyzer):
+    """שמירת כל שורות הדוח בהיסטוריה (חוסם - רץ ב-thread)"""
+    report_store.save_report(email_data.get('date'), analyzer.records(),
+                             email_data.get('message_id'))
+
+
+async def _store_history(email_data: dict, analyzer, report_file):
+    """שמירת ההיסטוריה אחרי שהסיכום כבר נשלח - כשל לא משפיע על הדוח"""
+    try:
+        await asyncio.to_thread(_save_history, email_data, analyzer)
+    except Exception as e:
+        logger.error(f"Could not store report history: {e}")
+    finally:
+        # ב-streaming השורות נקראות שוב מהקובץ - מוחקים רק אחרי השמירה
+        _remove_report_file(report_file)
+
+
+async def build_report(email_data: dict, id_number: str, progress=None,
+                       force: bool = False) -> str:
+    """
+    הורדה וניתוח הדוח של מייל, ושמירת הסיכום במטמון
+
+    Args:
+        email_data: התוצאה של get_latest_meitav_email
+        id_number: תעודת זהות להתחברות
+        progress: פונקציה אסינכרונית לדיווח התקדמות (טקסט), אופציונלי
+        force: פענוח מחדש גם אם אותו קובץ כבר במטמון הגיליונות
+
+    Returns:
+        סיכום הדוח
+
+    Raises:
+        ReportError: אם ההורדה או הניתוח נכשלו
+    """
+    progress = _safe_progress(progress or _no_progress)
+
+    # הכנת ה-downloader (הדפדפן מופעל רק אם צריך)
+    downloader = MeitavDownloader()
+    logger.info("Created MeitavDownloader instance")
+
+    await progress("⏳ מוריד את הדוח...")
+
+    # הורדת הדוח (תהליך אוטומטי - בלי OTP!)
+    try:
+        report_file = await downloader.download_report(email_data['download_url'], id_number)
+    except Exception as e:
+        logger.error(f"Error downloading report: {e}")
+        raise ReportError(f"❌ שגיאה בהורדת הדוח: {str(e)}")
+    finally:
+        await downloader.close()
+
+    if not report_file:
+        raise ReportError("❌ שגיאה בהורדת הקובץ - לא נמצא קובץ xlsx")
+
+    await progress("📊 מנתח את הדוח...")
+
+    # ניתוח הקובץ (ב-executor נפרד - הבוט ממשיך לענות בזמן הניתוח)
+    try:
+        # ה-hash מההורדה - אותו קובץ לא מפוענח פעמיים
+        report, analyzer = await analyze_report(report_file, sha256=downloader.file_sha256,
+                                                return_analyzer=True, use_cache=not force)
+    except asyncio.TimeoutError:
+        logger.error("Report analysis timed out")
+        _remove_report_file(report_file)
+        raise ReportError("❌ ניתוח הדוח ארך יותר מדי - נסה שוב מאוחר יותר")
+    except Exception as e:
+        logger.error(f"Error analyzing report: {e}")
+        _remove_report_file(report_file)
+        raise ReportError(f"❌ שגיאה בניתוח הדוח: {str(e)}")
+
+    summary_cache.put(email_data.get('message_id'), report, email_data.get('date'))
+
+    # ההיסטוריה נשמרת ברקע - לא מעכבת את התשובה ולא נכנסת למגבלת הזמן של הניתוח
+    task = asyncio.ensure_future(_store_history(email_data, analyzer, report_file))
+    _history_tasks.add(task)
+    task.add_done_callback(_history_tasks.discard)
+
+    return report
+
+
+# דוחות שנמצאים כרגע בהכנה: message ID -> task
+_in_flight = {}
+
+
+async def get_report(email_data: dict, id_number: str, progress=None,
+                     force: bool = False) -> str:
+    """
+    כמו build_report, אבל בקשות במקביל לאותו מייל מצטרפות לריצה אחת
+    (למשל "דוח" פעמיים ברצף, או בקשה בזמן ההורדה המוקדמת ברקע)
+
+    Raises:
+        ReportError: אם ההורדה או הניתוח נכשלו - לכל הממתינים
+    """
+    key = email_data.get('message_id') or email_data['download_url']
+
+    task = _in_flight.get(key)
+    if task is not None:
+        logger.info(f"Joining in-flight report for {key}")
+        if progress:
+            await progress("⏳ הדוח כבר בהכנה - ממתין לתוצאה...")
+    else:
+        task = asyncio.ensure_future(build_report(email_data, id_number, progress, force))
+        _in_flight[key] = task
+        task.add_done_callback(lambda _: _in_flight.pop(key, None))
+
+    # ביטול של ממתין אחד לא מבטל את הריצה של כולם
+    return await asyncio.shield(task)
@@ -0,0 +1,159 @@
+"""
+Report Store
+============
+היסטוריה של הדוחות היומיים ב-SQLite
+כל השורות של כל יום נשמרות (ריג'קטים, ממתינים להפקדה, ניוד נכנס/יוצא, הצטרפויות),
+עם אינדקסים לפי תאריך, שם עמית ומוצר - לשאילתות מגמה בלי להוריד שוב
+"""
+
+import os
+import time
+import sqlite3
+import logging
+import threading
+from datetime import datetime, date, timedelta
+from typing import Dict, List, Any, Iterable
+
+logger = logging.getLogger(__name__)
+
+REPORT_STORE_PATH = os.getenv('REPORT_STORE_PATH', '/tmp/meitav_cache/reports.db')
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS reports (
+    report_date TEXT PRIMARY KEY,
+    message_id TEXT,
+    saved_at REAL
+);
+CREATE TABLE IF NOT EXISTS report_rows (
+    report_date TEXT NOT NULL,
+    category TEXT NOT NULL,
+    name TEXT,
+    product TEXT,
+    reason TEXT,
+    amount REAL
+);
+CREATE INDEX IF NOT EXISTS idx_rows_date ON report_rows (report_date, category);
+CREATE INDEX IF NOT EXISTS idx_rows_name_nocase ON report_rows (name COLLATE NOCASE, category, report_date);
+CREATE INDEX IF NOT EXISTS idx_rows_product ON report_rows (product, report_date);
+"""
+
+_connection = None
+_lock = threading.Lock()
+
+
+def _connect() -> sqlite3.Connection:
+    """חיבור משותף - נפתח פעם אחת (השמירה רצה מתהליכון הניתוח)"""
+    global _connection
+    if _connection is None:
+        os.makedirs(os.path.dirname(REPORT_STORE_PATH), exist_ok=True)
+        _connection = sqlite3.connect(REPORT_STORE_PATH, check_same_thread=False)
+        _connection.execute('PRAGMA journal_mode=WAL')
+        _connection.executescript(SCHEMA)
+    return _connection
+
+
+def to_iso_date(report_date: str) -> str:
+    """תאריך הדוח (dd/mm/yyyy מהמייל) כ-YYYY-MM-DD, או היום אם לא ידוע"""
+    try:
+        return datetime.strptime(report_date, '%d/%m/%Y').date().isoformat()
+    except (TypeError, ValueError):
+        return date.today().isoformat()
+
+
+def save_report(report_date: str, records: Iterable[Dict[str, Any]], message_id: str = None):
+    """
+    שמירת כל השורות של דוח יומי - דוח של אותו תאריך מחליף את הקודם
+
+    Args:
+        report_date: תאריך הדוח (dd/mm/yyyy)
+        records: השורות מ-ExcelAnalyzer.records() - נכתבות תוך כדי קריאה, בלי רשימה בזיכרון
+    """
+    day = to_iso_date(report_date)
+    count = 0
+
+    def rows():
+        nonlocal count
+        for r in records:
+            count += 1
+            yield day, r['category'], r['name'], r['product'], r['reason'], r['amount']
+
+    with _lock:
+        conn = _connect()
+        with conn:
+            conn.execute('DELETE FROM report_rows WHERE report_date = ?', (day,))
+            conn.executemany(
+                'INSERT INTO report_rows (report_date, category, name, product, reason, amount) '
+                'VALUES (?, ?, ?, ?, ?, ?)',
+                rows()
+            )
+            conn.execute(
+                'INSERT OR REPLACE INTO reports (report_date, message_id, saved_at) VALUES (?, ?, ?)',
+                (day, message_id, time.time())
+            )
+    logger.info(f"Stored {count} rows for report {day}")
+
+
+def trend(category: str, days: int = 30) -> List[Dict[str, Any]]:
+    """
+    מגמה יומית של קטגוריה: מספר שורות וסכום לכל יום
+
+    Returns:
+        רשימה לפי תאריך: {date, count, amount}
+    """
+    since = (date.today() - timedelta(days=days)).isoformat()
+    with _lock:
+        cursor = _connect().execute(
+            'SELECT r.report_date, COUNT(rr.category), COALESCE(SUM(rr.amount), 0) '
+            'FROM reports r LEFT JOIN report_rows rr '
+            'ON rr.report_date = r.report_date AND rr.category = ? '
+            'WHERE r.report_date >= ? GROUP BY r.report_date ORDER BY r.report_date',
+            (category, since)
+        )
+        return [{'date': d, 'count': c, 'amount': a} for d, c, a in cursor.fetchall()]
+
+
+def _like_prefix(text: str) -> str:
+    """תבנית LIKE לחיפוש לפי תחילת השם - בלי תווים מיוחדים מהקלט"""
+    escaped = text.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+    return escaped + '%'
+
+
+def pending_since(name: str) -> Dict[str, Any]:
+    """
+    כמה זמן עמית ממתין להפקדה ראשונה ברצף הנוכחי (חיפוש לפי תחילת השם)
+
+    Returns:
+        {name, first_seen, last_seen, days} - או None אם לא נמצא
+    """
+    with _lock:
+        conn = _connect()
+        # תבנית בלי wildcard בהתחלה - החיפוש עובר דרך idx_rows_name_nocase
+        row = conn.execute(
+            "SELECT name, MAX(report_date) FROM report_rows "
+            "WHERE name LIKE ? ESCAPE '\\' AND category = 'pending_deposits' "
+            'GROUP BY name ORDER BY MAX(report_date) DESC LIMIT 1',
+            (_like_prefix(name),)
+        ).fetchone()
+        if row is None:
+            return None
+        full_name, last_seen = row
+
+        pending_dates = {d for (d,) in conn.execute(
+            "SELECT DISTINCT report_date FROM report_rows "
+            "WHERE name = ? COLLATE NOCASE AND category = 'pending_deposits'",
+            (full_name,)
+        )}
+        report_dates = [d for (d,) in conn.execute(
+            'SELECT report_date FROM reports WHERE report_date <= ? ORDER BY report_date DESC',
+            (last_seen,)
+        )]
+
+    # תחילת הרצף: הולכים אחורה על ימי הדוחות כל עוד העמית ממתין בהם
+    first_seen = last_seen
+    for report_date in report_dates:
+        if report_date not in pending_dates:
+            break
+        first_seen = report_date
+
+    days = (date.fromisoformat(last_seen) - date.fromisoformat(first_seen)).days
+    return {'name': full_name, 'first_seen': first_seen, 'last_seen': last_seen, 'days': days}
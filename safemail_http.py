@@ -0,0 +1,263 @@
+"""
+SafeMail HTTP Login
+===================
+התחברות לאתר SafeMail של מיטב ב-HTTP בלבד, בלי דפדפן
+מפענח את טופס ה-ASP.NET, שולח את תעודת הזהות ומוצא את קישור הקובץ
+"""
+
+import re
+import logging
+from html.parser import HTMLParser
+from urllib.parse import urljoin
+
+logger = logging.getLogger(__name__)
+
+LOGIN_BUTTON_WORDS = ('התחבר', 'כניסה', 'login', 'submit')
+TEXT_INPUT_TYPES = ('text', 'password', 'tel')
+
+POSTBACK_RE = re.compile(r"__doPostBack\(\s*'([^']*)'\s*,\s*'([^']*)'\s*\)")
+DOWNLOAD_HREF_RE = re.compile(r'href=["\']([^"\']*(?:download|attachment|xlsx)[^"\']*)["\']', re.IGNORECASE)
+
+
+class UnrecognizedLoginForm(Exception):
+    """מבנה הדף לא מוכר - צריך לחזור לדפדפן"""
+
+
+class NoDownloadLink(Exception):
+    """ההתחברות נשלחה אבל בעמוד המסמכים אין קישור לקובץ - לא שולחים שוב בדפדפן"""
+
+
+class _PageParser(HTMLParser):
+    """איסוף טפסים, שדות, כפתורים וקישורים מדף HTML"""
+
+    def __init__(self):
+        super().__init__(convert_charrefs=True)
+        self.forms = []
+        self.links = []
+        self._link = None
+        self._button = None
+
+    def handle_starttag(self, tag, attrs):
+        attrs = {k: v or '' for k, v in attrs}
+        style = attrs.get('style', '').replace(' ', '').lower()
+        hidden = 'display:none' in style or 'visibility:hidden' in style
+
+        if tag == 'form':
+            self.forms.append({
+                'action': attrs.get('action', ''),
+                'method': (attrs.get('method') or 'get').lower(),
+                'inputs': [],
+                'buttons': []
+            })
+        elif tag == 'input' and self.forms:
+            input_type = (attrs.get('type') or 'text').lower()
+            self.forms[-1]['inputs'].append({
+                'type': input_type,
+                'name': attrs.get('name', ''),
+                'value': attrs.get('value', ''),
+                'checked': 'checked' in attrs,
+                'visible': input_type != 'hidden' and not hidden
+            })
+        elif tag == 'button' and self.forms:
+            self._button = {
+                'type': (attrs.get('type') or 'submit').lower(),
+                'name': attrs.get('name', ''),
+                'value': attrs.get('value', ''),
+                'text': ''
+            }
+            self.forms[-1]['buttons'].append(self._button)
+        elif tag == 'a':
+            self._link = {'href': attrs.get('href', ''), 'text': ''}
+            self.links.append(self._link)
+
+    def handle_endtag(self, tag):
+        if tag == 'a':
+            self._link = None
+        elif tag == 'button':
+            self._button = None
+
+    def handle_data(self, data):
+        if self._link is not None:
+            self._link['text'] += data
+        if self._button is not None:
+            self._button['text'] += data
+
+
+def parse_page(html: str) -> _PageParser:
+    """פענוח דף HTML"""
+    parser = _PageParser()
+    parser.feed(html)
+    parser.close()
+    return parser
+
+
+def _is_login_text(text: str) -> bool:
+    text = text or ''
+    return any(word in text or word in text.lower() for word in LOGIN_BUTTON_WORDS)
+
+
+def build_login_payload(page: _PageParser, id_number: str) -> tuple:
+    """
+    בניית בקשת ההתחברות מטופס ה-ASP.NET
+
+    Returns:
+        (action, fields) - כתובת השליחה (יחסית) והשדות לשליחה
+
+    Raises:
+        UnrecognizedLoginForm: אם הטופס לא במבנה המוכר
+    """
+    if len(page.forms) != 1:
+        raise UnrecognizedLoginForm(f"expected one form, found {len(page.forms)}")
+
+    form = page.forms[0]
+    if form['method'] != 'post':
+        raise UnrecognizedLoginForm("login form is not a POST form")
+
+    names = {inp['name'] for inp in form['inputs']}
+    if '__VIEWSTATE' not in names:
+        raise UnrecognizedLoginForm("no ASP.NET __VIEWSTATE field")
+
+    id_fields = [inp for inp in form['inputs'] if inp['visible'] and inp['type'] in TEXT_INPUT_TYPES]
+    if len(id_fields) != 1 or not id_fields[0]['name']:
+        raise UnrecognizedLoginForm(f"expected one visible ID field, found {len(id_fields)}")
+
+    # כל השדות הרגילים (hidden וכו') נשלחים כמו שהם; checkbox ו-radio רק אם מסומנים, כמו בדפדפן
+    fields = {}
+    for inp in form['inputs']:
+        if not inp['name'] or inp['type'] in ('submit', 'image', 'button', 'reset'):
+            continue
+        if inp['type'] in ('checkbox', 'radio'):
+            if inp['checked']:
+                fields[inp['name']] = inp['value'] or 'on'
+            continue
+        fields[inp['name']] = inp['value']
+    fields[id_fields[0]['name']] = id_number
+
+    # כפתור שליחה: input submit, button, או קישור __doPostBack
+    submit_inputs = [inp for inp in form['inputs'] if inp['type'] in ('submit', 'image') and inp['name']]
+    submit = next((inp for inp in submit_inputs if _is_login_text(inp['value'])), None)
+    if submit is None and submit_inputs:
+        submit = submit_inputs[0]
+
+    if submit is None:
+        submit = next(
+            (b for b in form['buttons'] if b['type'] == 'submit' and b['name'] and _is_login_text(b['text'] or b['value'])),
+            None
+        )
+
+    if submit is not None:
+        fields[submit['name']] = submit['value']
+        return form['action'], fields
+
+    for link in page.links:
+        postback = POSTBACK_RE.search(link['href'])
+        if postback and _is_login_text(link['text']):
+            fields['__EVENTTARGET'] = postback.group(1)
+            fields['__EVENTARGUMENT'] = postback.group(2)
+            return form['action'], fields
+
+    raise UnrecognizedLoginForm("no login submit control")
+
+
+def pick_download_link(links: list) -> tuple:
+    """
+    בחירת קישור הקובץ מתוך רשימת קישורים (href, text)
+
+    Returns:
+        (url, file_name) או (None, None)
+    """
+    for link in links:
+        href = link['href']
+        text = link['text']
+
+        if href and ('.xlsx' in href.lower() or 'download' in href.lower() or 'attachment' in href.lower()):
+            return href, text.strip() if text else "report.xlsx"
+
+        # מחפש גם לפי טקסט
+        if '.xlsx' in text.lower():
+            return href, text.strip()
+
+    return None, None
+
+
+def find_download_href(html: str, page_url: str) -> str:
+    """חיפוש URL של קובץ בתוכן הדף הגולמי"""
+    urls = DOWNLOAD_HREF_RE.findall(html)
+    return urljoin(page_url, urls[0]) if urls else None
+
+
+async def http_login(session, url: str, id_number: str, ssl=None) -> tuple:
+    """
+    התחברות ל-SafeMail ומציאת קישור הקובץ - HTTP בלבד
+
+    Args:
+        session: aiohttp.ClientSession עם cookie jar משלו
+        url: קישור ההתחברות מהמייל
+        id_number: תעודת זהות
+        ssl: הגדרות TLS של aiohttp - ברירת המחדל בודקת את התעודה
+
+    Returns:
+        (download_url, file_name, documents_url) - documents_url הוא עמוד המסמכים
+        שאליו הגענו אחרי ההתחברות (לבדיקת session שמור בפעם הבאה)
+
+    Raises:
+        UnrecognizedLoginForm: אם טופס ההתחברות לא מוכר (לפני ששלחנו משהו)
+        NoDownloadLink: אם אחרי ההתחברות אין קישור לקובץ
+    """
+    async with session.get(url, ssl=ssl) as response:
+        response.raise_for_status()
+        login_html = await response.text()
+        login_url = str(response.url)
+
+    action, fields = build_login_payload(parse_page(login_html), id_number)
+    post_url = urljoin(login_url, action) if action else login_url
+    logger.info(f"Posting SafeMail login form ({len(fields)} fields)")
+
+    # ההפניות (302) אחרי ההתחברות מטופלות אוטומטית
+    async with session.post(post_url, data=fields, ssl=ssl) as response:
+        response.raise_for_status()
+        documents_html = await response.text()
+        documents_url = str(response.url)
+
+    href, file_name = documents_link(documents_html, documents_url)
+    if not href:
+        raise NoDownloadLink("no download link on documents page")
+
+    return href, file_name, documents_url
+
+
+def documents_link(html: str, page_url: str) -> tuple:
+    """
+    קישור הקובץ מעמוד המסמכים
+
+    Returns:
+        (download_url, file_name) או (None, None)
+    """
+    page = parse_page(html)
+    href, file_name = pick_download_link(
+        [{'href': urljoin(page_url, l['href']), 'text': l['text']}
+         for l in page.links if l['href'] and not l['href'].startswith('javascript:')]
+    )
+    if not href:
+        href = find_download_href(html, page_url)
+    return href, file_name
+
+
+async def session_download_link(session, url: str, cookies: list, ssl=None) -> tuple:
+    """
+    ניסיון להגיע לעמוד המסמכים עם קוקיז שמורים, בלי להתחבר
+
+    Args:
+        url: כתובת עמוד המסמכים שנשמרה עם הקוקיז (לא הקישור מהמייל)
+
+    Returns:
+        (download_url, file_name), או (None, None) אם השרת דחה את ה-session
+    """
+    cookie_header = '; '.join(f"{c['name']}={c['value']}" for c in cookies)
+    async with session.get(url, headers={'Cookie': cookie_header}, ssl=ssl) as response:
+        if response.status != 200:
+            return None, None
+        html = await response.text()
+        page_url = str(response.url)
+
+    return documents_link(html, page_url)
@@ -0,0 +1,148 @@
+"""
+Schema Index
+============
+מיפוי מבנה הדוח: גיליון -> תפקיד, עמודה -> תפקיד
+המיפוי נשמר בדיסק לפי טביעת אצבע של שמות הגיליונות והעמודות,
+כך שמבנה שחוזר כל יום לא מפוענח מחדש, ושינוי במבנה מזוהה ונרשם בלוג
+"""
+
+import os
+import json
+import hashlib
+import logging
+from typing import Dict, List, Any
+
+logger = logging.getLogger(__name__)
+
+SCHEMA_CACHE_PATH = os.getenv('SCHEMA_CACHE_PATH', '/tmp/meitav_cache/schema_index.json')
+# כמה מבנים שונים לשמור
+SCHEMA_CACHE_MAX_LAYOUTS = 20
+
+# תפקידי הגיליונות - רק גיליונות שמתאימים לתפקיד כלשהו נטענים
+SHEET_ROLES = {
+    'rejects': lambda name: any(r in name for r in ['ריג\'קטים בהצטרפות', 'ריגקטים בהצטרפות', 'rejects']),
+    'join_tracking': lambda name: 'מעקב הצטרפויות' in name,
+    'transfers_in': lambda name: any(t in name.lower() for t in ['העברה פנימה', 'ניוד נכנס', 'transfer in']),
+    'transfers_out': lambda name: any(t in name.lower() for t in ['העברה החוצה', 'ניוד יוצא', 'transfer out']),
+    'new_joins': lambda name: 'הצטרפויות' in name and 'מעקב' not in name,
+}
+
+# תפקידי העמודות - מילות מפתח לפי סדר עדיפות
+COLUMN_ROLES = {
+    'name': ['שם', 'עמית'],
+    'reject_name': ['שם', 'עמית', 'name'],
+    'product': ['מוצר', 'קופה', 'product'],
+    'reason': ['סיבה', 'תיאור', 'reason', 'ריג\'קט'],
+    'amount': ['סכום', 'יתרה', 'amount'],
+}
+STATUS_KEYWORD = 'סטטוס'
+
+
+def sheet_roles(sheet_name: str) -> List[str]:
+    """התפקידים שגיליון ממלא לפי השם שלו"""
+    return [role for role, matches in SHEET_ROLES.items() if matches(sheet_name)]
+
+
+def find_column(columns, keywords: List[str]) -> int:
+    """מיקום העמודה הראשונה שמתאימה למילות המפתח, או None"""
+    for position, col in enumerate(columns):
+        col_str = str(col).lower()
+        for keyword in keywords:
+            if keyword.lower() in col_str:
+                return position
+    return None
+
+
+def fingerprint(sheet_names: List[str], sheet_columns: Dict[str, list]) -> str:
+    """טביעת אצבע של מבנה הקובץ"""
+    layout = [[name, [str(c) for c in sheet_columns.get(name, [])]] for name in sheet_names]
+    return hashlib.sha256(json.dumps(layout, ensure_ascii=False).encode()).hexdigest()
+
+
+def build_layout(sheet_names: List[str], sheet_columns: Dict[str, list]) -> Dict[str, Any]:
+    """גילוי תפקידי הגיליונות והעמודות (מיקומי עמודות, לא שמות)"""
+    sheets = {}
+    for name in sheet_names:
+        roles = sheet_roles(name)
+        if not roles:
+            continue
+        columns = sheet_columns.get(name, [])
+        sheets[name] = {
+            'roles': roles,
+            'columns': {role: find_column(columns, keywords) for role, keywords in COLUMN_ROLES.items()},
+            'status': [i for i, col in enumerate(columns) if STATUS_KEYWORD in str(col)],
+        }
+    return {'sheets': sheets}
+
+
+def _read_cache() -> Dict[str, Any]:
+    try:
+        with open(SCHEMA_CACHE_PATH, 'r', encoding='utf-8') as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+    except Exception as e:
+        logger.warning(f"Could not read schema cache: {e}")
+        return {}
+
+
+def _write_cache(cache: Dict[str, Any]):
+    try:
+        os.makedirs(os.path.dirname(SCHEMA_CACHE_PATH), exist_ok=True)
+        tmp_path = SCHEMA_CACHE_PATH + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(cache, f, ensure_ascii=False)
+        os.replace(tmp_path, SCHEMA_CACHE_PATH)
+    except Exception as e:
+        logger.warning(f"Could not write schema cache: {e}")
+
+
+class SchemaIndex:
+    """
+    מבנה הדוח: אילו גיליונות ממלאים כל תפקיד ובאיזו עמודה נמצא כל שדה
+
+    Args:
+        sheet_names: כל שמות הגיליונות לפי סדר הקובץ
+        sheet_columns: עמודות הגיליונות הרלוונטיים
+    """
+
+    def __init__(self, sheet_names: List[str], sheet_columns: Dict[str, list]):
+        self.fingerprint = fingerprint(sheet_names, sheet_columns)
+
+        cache = _read_cache()
+        layouts = cache.get('layouts', {})
+        last_fingerprint = cache.get('last_fingerprint')
+
+        if last_fingerprint and last_fingerprint != self.fingerprint:
+            logger.warning(
+                f"Workbook layout changed ({last_fingerprint[:12]} -> {self.fingerprint[:12]})"
+            )
+
+        layout = layouts.get(self.fingerprint)
+        if layout is not None:
+            logger.info(f"Using cached schema for layout {self.fingerprint[:12]}")
+        else:
+            layout = build_layout(sheet_names, sheet_columns)
+            logger.info(f"Built schema for new layout {self.fingerprint[:12]}")
+
+        self.layout = layout
+
+        if last_fingerprint != self.fingerprint:
+            # הכי חדש בסוף - הישנים נמחקים מעבר למגבלה
+            layouts.pop(self.fingerprint, None)
+            layouts[self.fingerprint] = layout
+            while len(layouts) > SCHEMA_CACHE_MAX_LAYOUTS:
+                layouts.pop(next(iter(layouts)))
+            _write_cache({'last_fingerprint': self.fingerprint, 'layouts': layouts})
+
+    def sheets_for(self, role: str) -> List[str]:
+        """שמות הגיליונות שממלאים תפקיד, לפי סדר הקובץ"""
+        return [name for name, sheet in self.layout['sheets'].items() if role in sheet['roles']]
+
+    def column(self, sheet_name: str, role: str) -> int:
+        """מיקום העמודה של תפקיד בגיליון, או None"""
+        return self.layout['sheets'][sheet_name]['columns'].get(role)
+
+    def status_columns(self, sheet_name: str) -> List[int]:
+        """מיקומי עמודות הסטטוס בגיליון"""
+        return self.layout['sheets'][sheet_name]['status']
@@ -0,0 +1,139 @@
+"""
+Session Cache
+=============
+שמירת קוקיז של SafeMail בדיסק (מוצפן) בין הורדות
+המפתח: תעודת זהות + שרת SafeMail. ה-session שייך לקישור מהמייל שממנו התחברנו
+"""
+
+import os
+import json
+import time
+import base64
+import hashlib
+import logging
+from email.utils import parsedate_to_datetime
+
+logger = logging.getLogger(__name__)
+
+SESSION_CACHE_DIR = os.getenv('SESSION_CACHE_DIR', '/tmp/meitav_cache/sessions')
+# גיל מקסימלי של session שמור (שניות)
+SESSION_CACHE_TTL = int(os.getenv('SESSION_CACHE_TTL', '1800'))
+
+try:
+    from cryptography.fernet import Fernet, InvalidToken
+except ImportError:
+    Fernet = None
+    InvalidToken = Exception
+
+
+def _get_fernet():
+    """מפתח ההצפנה - מ-SESSION_CACHE_KEY או נגזר מטוקן הבוט"""
+    if Fernet is None:
+        return None
+
+    secret = os.getenv('SESSION_CACHE_KEY') or os.getenv('TELEGRAM_TOKEN')
+    if not secret:
+        return None
+
+    key = base64.urlsafe_b64encode(hashlib.sha256(secret.encode()).digest())
+    return Fernet(key)
+
+
+def _cache_file(id_number: str, host: str) -> str:
+    digest = hashlib.sha256(f"{id_number}|{host}".encode()).hexdigest()
+    return os.path.join(SESSION_CACHE_DIR, f"{digest}.session")
+
+
+def _cookie_expiry(cookie: dict) -> float:
+    """זמן פקיעת קוקי (epoch) או None ל-session cookie"""
+    expires = cookie.get('expires')
+    if expires in (None, '', -1):
+        return None
+    if isinstance(expires, (int, float)):
+        return float(expires)
+    try:
+        return parsedate_to_datetime(expires).timestamp()
+    except Exception:
+        return None
+
+
+def load(id_number: str, host: str, login_url: str) -> tuple:
+    """
+    טעינת קוקיז שמורים
+
+    Args:
+        login_url: הקישור מהמייל הנוכחי - session של מייל אחר לא מוחזר
+
+    Returns:
+        (רשימת קוקיז name/value, כתובת עמוד המסמכים) או (None, None) אם אין / פג תוקף
+    """
+    fernet = _get_fernet()
+    path = _cache_file(id_number, host)
+    if fernet is None or not os.path.exists(path):
+        return None, None
+
+    try:
+        with open(path, 'rb') as f:
+            data = json.loads(fernet.decrypt(f.read(), ttl=SESSION_CACHE_TTL))
+    except InvalidToken:
+        logger.info("Cached SafeMail session expired or unreadable")
+        invalidate(id_number, host)
+        return None, None
+    except Exception as e:
+        logger.warning(f"Could not read session cache: {e}")
+        return None, None
+
+    now = time.time()
+    cookies = data.get('cookies', [])
+    if any(exp is not None and exp <= now for exp in map(_cookie_expiry, cookies)):
+        logger.info("Cached SafeMail session has expired cookies")
+        invalidate(id_number, host)
+        return None, None
+
+    # בלי עמוד המסמכים אין מה לבדוק
+    if not data.get('documents_url'):
+        return None, None
+
+    # עמוד המסמכים מציג את הקובץ של המייל שממנו התחברנו - במייל חדש מתחברים מחדש
+    if data.get('login_url') != login_url:
+        logger.info("Cached SafeMail session belongs to another email")
+        return None, None
+
+    return cookies, data['documents_url']
+
+
+def save(id_number: str, host: str, cookies: list, documents_url: str, login_url: str):
+    """שמירת קוקיז אחרי התחברות מוצלחת, עם הקישור מהמייל ועמוד המסמכים שאליו הגענו"""
+    fernet = _get_fernet()
+    if fernet is None or not cookies or not documents_url:
+        return
+
+    data = {
+        'saved_at': time.time(),
+        'login_url': login_url,
+        'documents_url': documents_url,
+        'cookies': [
+            {'name': c['name'], 'value': c['value'], 'expires': _cookie_expiry(c)}
+            for c in cookies
+        ]
+    }
+
+    try:
+        os.makedirs(SESSION_CACHE_DIR, exist_ok=True)
+        path = _cache_file(id_number, host)
+        with open(path + '.tmp', 'wb') as f:
+            f.write(fernet.encrypt(json.dumps(data).encode()))
+        os.replace(path + '.tmp', path)
+        logger.info(f"Saved SafeMail session ({len(cookies)} cookies)")
+    except Exception as e:
+        logger.warning(f"Could not save session cache: {e}")
+
+
+def invalidate(id_number: str, host: str):
+    """מחיקת session שמור (למשל אחרי שהשרת דחה אותו)"""
+    try:
+        os.remove(_cache_file(id_number, host))
+    except FileNotFoundError:
+        pass
+    except Exception as e:
+        logger.warning(f"Could not remove session cache: {e}")
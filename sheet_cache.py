@@ -0,0 +1,156 @@
+"""
+Sheet Cache
+===========
+מטמון של גיליונות מפוענחים, לפי SHA-256 של קובץ ה-xlsx
+אותו קובץ לא מפוענח פעמיים - הגיליונות נטענים מ-Feather (או pickle בלי pyarrow)
+המטמון מוגבל בגודל, והרשומות שלא נקראו הכי הרבה זמן נמחקות ראשונות
+"""
+
+import os
+import json
+import shutil
+import hashlib
+import logging
+import importlib.util
+import pandas as pd
+from typing import Dict, List
+
+logger = logging.getLogger(__name__)
+
+SHEET_CACHE_DIR = os.getenv('SHEET_CACHE_DIR', '/tmp/meitav_cache/sheets')
+# גודל מקסימלי של כל המטמון (bytes)
+SHEET_CACHE_MAX_BYTES = int(os.getenv('SHEET_CACHE_MAX_BYTES', str(200 * 1024 * 1024)))
+SHEET_CACHE_ENABLED = os.getenv('SHEET_CACHE_ENABLED', '1') == '1'
+PYARROW_AVAILABLE = importlib.util.find_spec('pyarrow') is not None
+
+MANIFEST = 'manifest.json'
+
+
+def file_sha256(source) -> str:
+    """SHA-256 של הקובץ (נתיב או אובייקט קובץ)"""
+    sha256 = hashlib.sha256()
+    if isinstance(source, str):
+        with open(source, 'rb') as f:
+            for block in iter(lambda: f.read(1024 * 1024), b''):
+                sha256.update(block)
+    elif hasattr(source, 'getbuffer'):
+        sha256.update(source.getbuffer())
+    else:
+        position = source.tell()
+        source.seek(0)
+        for block in iter(lambda: source.read(1024 * 1024), b''):
+            sha256.update(block)
+        source.seek(position)
+    return sha256.hexdigest()
+
+
+def _entry_dir(sha256: str) -> str:
+    return os.path.join(SHEET_CACHE_DIR, sha256)
+
+
+def _write_frame(frame: pd.DataFrame, path: str) -> str:
+    """שמירת גיליון - Feather כשאפשר, אחרת pickle. מחזיר את שם הקובץ"""
+    if PYARROW_AVAILABLE:
+        try:
+            # Feather דורש שמות עמודות טקסט; הניתוח עובד לפי מיקום העמודות
+            frame.set_axis([str(c) for c in frame.columns], axis=1).reset_index(drop=True).to_feather(path + '.feather')
+            return os.path.basename(path) + '.feather'
+        except Exception as e:
+            # למשל עמודה עם טקסט ומספרים מעורבבים
+            logger.debug(f"Feather write failed, using pickle: {e}")
+    frame.to_pickle(path + '.pkl')
+    return os.path.basename(path) + '.pkl'
+
+
+def _read_frame(path: str) -> pd.DataFrame:
+    if path.endswith('.feather'):
+        return pd.read_feather(path)
+    return pd.read_pickle(path)
+
+
+def load(sha256: str) -> tuple:
+    """
+    טעינת גיליונות מהמטמון
+
+    Returns:
+        (כל שמות הגיליונות, שם גיליון -> DataFrame), או (None, None) אם אין
+    """
+    if not SHEET_CACHE_ENABLED or not sha256:
+        return None, None
+
+    entry = _entry_dir(sha256)
+    try:
+        with open(os.path.join(entry, MANIFEST), 'r', encoding='utf-8') as f:
+            manifest = json.load(f)
+        frames = {
+            name: _read_frame(os.path.join(entry, file_name))
+            for name, file_name in manifest['files'].items()
+        }
+    except FileNotFoundError:
+        return None, None
+    except Exception as e:
+        logger.warning(f"Could not read sheet cache {sha256[:12]}: {e}")
+        invalidate(sha256)
+        return None, None
+
+    # זמן הגישה האחרון קובע את סדר המחיקה
+    os.utime(entry)
+    logger.info(f"Loaded {len(frames)} sheets from cache ({sha256[:12]})")
+    return manifest['sheet_names'], frames
+
+
+def save(sha256: str, sheet_names: List[str], frames: Dict[str, pd.DataFrame]):
+    """שמירת הגיליונות שפוענחו"""
+    if not SHEET_CACHE_ENABLED or not sha256 or not frames:
+        return
+
+    entry = _entry_dir(sha256)
+    tmp_entry = entry + '.tmp'
+    try:
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        os.makedirs(tmp_entry)
+        files = {
+            name: _write_frame(frame, os.path.join(tmp_entry, f'sheet{i}'))
+            for i, (name, frame) in enumerate(frames.items())
+        }
+        with open(os.path.join(tmp_entry, MANIFEST), 'w', encoding='utf-8') as f:
+            json.dump({'sheet_names': sheet_names, 'files': files}, f, ensure_ascii=False)
+
+        shutil.rmtree(entry, ignore_errors=True)
+        os.replace(tmp_entry, entry)
+        logger.info(f"Saved {len(files)} sheets to cache ({sha256[:12]})")
+    except Exception as e:
+        logger.warning(f"Could not save sheet cache: {e}")
+        shutil.rmtree(tmp_entry, ignore_errors=True)
+        return
+
+    _evict()
+
+
+def _dir_size(path: str) -> int:
+    return sum(entry.stat().st_size for entry in os.scandir(path) if entry.is_file())
+
+
+def _evict():
+    """מחיקת הרשומות הישנות ביותר (LRU) עד שהמטמון בגבול הגודל"""
+    try:
+        entries = [
+            (entry.stat().st_mtime, entry.path, _dir_size(entry.path))
+            for entry in os.scandir(SHEET_CACHE_DIR)
+            if entry.is_dir() and not entry.name.endswith('.tmp')
+        ]
+    except FileNotFoundError:
+        return
+
+    total = sum(size for _, _, size in entries)
+    for _, path, size in sorted(entries):
+        if total <= SHEET_CACHE_MAX_BYTES:
+            break
+        shutil.rmtree(path, ignore_errors=True)
+        total -= size
+        logger.info(f"Evicted sheet cache {os.path.basename(path)[:12]}")
+
+
+def invalidate(sha256: str):
+    """מחיקת רשומה מהמטמון"""
+    shutil.rmtree(_entry_dir(sha256), ignore_errors=True)
@@ -0,0 +1,66 @@
+"""
+Summary Cache
+=============
+סיכומי דוחות שכבר נותחו, לפי ה-message ID של המייל ב-Gmail
+הדוח של מייל מסוים לא משתנה - אין סיבה להוריד ולנתח אותו שוב
+"""
+
+import os
+import json
+import time
+import logging
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_CACHE_PATH = os.getenv('SUMMARY_CACHE_PATH', '/tmp/meitav_cache/summaries.json')
+# כמה סיכומים לשמור (הישנים נמחקים)
+SUMMARY_CACHE_MAX_ENTRIES = int(os.getenv('SUMMARY_CACHE_MAX_ENTRIES', '30'))
+
+_entries = None
+
+
+def _load_entries() -> dict:
+    global _entries
+    if _entries is None:
+        try:
+            with open(SUMMARY_CACHE_PATH, 'r', encoding='utf-8') as f:
+                _entries = json.load(f)
+        except FileNotFoundError:
+            _entries = {}
+        except Exception as e:
+            logger.warning(f"Could not read summary cache: {e}")
+            _entries = {}
+    return _entries
+
+
+def get(message_id: str) -> dict:
+    """
+    הסיכום השמור של מייל
+
+    Returns:
+        dict עם summary, date, saved_at - או None
+    """
+    if not message_id:
+        return None
+    return _load_entries().get(message_id)
+
+
+def put(message_id: str, summary: str, report_date: str = None):
+    """שמירת סיכום אחרי ניתוח מוצלח"""
+    if not message_id:
+        return
+
+    entries = _load_entries()
+    entries.pop(message_id, None)
+    entries[message_id] = {'summary': summary, 'date': report_date, 'saved_at': time.time()}
+    while len(entries) > SUMMARY_CACHE_MAX_ENTRIES:
+        entries.pop(next(iter(entries)))
+
+    try:
+        os.makedirs(os.path.dirname(SUMMARY_CACHE_PATH), exist_ok=True)
+        with open(SUMMARY_CACHE_PATH + '.tmp', 'w', encoding='utf-8') as f:
+            json.dump(entries, f, ensure_ascii=False)
+        os.replace(SUMMARY_CACHE_PATH + '.tmp', SUMMARY_CACHE_PATH)
+    except Exception as e:
+        logger.warning(f"Could not save summary cache: {e}")
+